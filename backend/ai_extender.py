@@ -1,181 +1,615 @@
 # Uses AI to generate top/bottom image extensions
 import os
 import requests
-from PIL import Image, ImageFilter, ImageOps
+from PIL import Image
 import io
 import base64
 import random
 import numpy as np
 import cv2
 import time
+from concurrent.futures import Future
+from extension_cache import ExtensionCache
+from quality import psnr, ssim
 
 class AIImageExtender:
-    def __init__(self):
-        """Initialize the image extender with optional API key"""
+    # Blur strength applied to the reflected strip (sigma, as PIL's GaussianBlur radius)
+    BLUR_SIGMA = 5
+    # Rows blurred beyond the visible strip so the window edge never bleeds into it
+    BLUR_MARGIN = 16
+
+    def __init__(self, cache=None, scale=1.0):
+        """
+        Initialize the image extender
+
+        Args:
+            cache: ExtensionCache for similar extension requests (a default
+                100-entry LRU cache is created when omitted)
+            scale: Resolution (0-1] the extension is generated at before being
+                upsampled into the canvas; the original frame always stays full size
+        """
+        if not 0 < scale <= 1:
+            raise ValueError(f"Extension scale must be in (0, 1], got {scale}")
+
         # Local cache for similar extension requests
-        self.extension_cache = {}
-        self.cache_hits = 0
-        self.cache_misses = 0
-    
+        self.extension_cache = cache if cache is not None else ExtensionCache()
+        self.scale = scale
+
+        # Alpha gradients depend only on the strip shape, so build each one once
+        self.gradient_cache = {}
+
+    @property
+    def cache_hits(self):
+        return self.extension_cache.hits
+
+    @property
+    def cache_misses(self):
+        return self.extension_cache.misses
+
+    def cache_stats(self):
+        """Hit/miss/eviction statistics of the extension cache"""
+        return self.extension_cache.stats()
+
     def extend_frame(self, image, position="bottom", extension_ratio=1.0):
         """
         Extend the image frame either at top or bottom
-        
+
         Args:
             image: PIL Image object
             position: "top" or "bottom" - where to add the extension
             extension_ratio: How much to extend relative to original height
-            
+
         Returns:
             PIL Image with extension
         """
-        width, height = image.size
+        frame = np.asarray(image.convert("RGB"))
+        return Image.fromarray(self.extend_array(frame, position, extension_ratio))
+
+    def extend_array(self, frame, position="bottom", extension_ratio=1.0, profiler=None):
+        """
+        Extend a frame array either at top or bottom
+
+        Every step works per channel, so the frame can be in RGB or BGR order
+        and the result keeps the same order (OpenCV frames need no conversion).
+
+        Args:
+            frame: uint8 numpy array of shape (height, width, 3)
+            position: "top" or "bottom" - where to add the extension
+            extension_ratio: How much to extend relative to original height
+            profiler: Optional StageProfiler that receives the cache lookup time
+
+        Returns:
+            uint8 numpy array of shape (height + extension_height, width, 3)
+        """
+        height, width = frame.shape[:2]
         extension_height = int(height * extension_ratio)
-        
-        # Create a padded canvas
+
+        extension = self._generate_extension_locally(frame, position, width, extension_height, profiler)
+        return self._compose(frame, extension, position)
+
+    def extend_batch(self, frames, position="bottom", extension_ratio=1.0, out=None, profiler=None):
+        """
+        Extend a stack of same-sized frames at once
+
+        The cache is consulted frame by frame in order (so results match
+        extend_array), then all misses are rendered together straight into
+        the output buffer.
+
+        Args:
+            frames: uint8 numpy array of shape (N, height, width, 3), RGB or BGR
+            position: "top" or "bottom" - where to add the extension
+            extension_ratio: How much to extend relative to original height
+            out: Optional preallocated uint8 array of shape
+                (N, height + extension_height, width, 3) to write into
+            profiler: Optional StageProfiler that receives the cache lookup time
+
+        Returns:
+            uint8 numpy array of shape (N, height + extension_height, width, 3)
+        """
+        return self.extend_variants(frames, [(position, extension_ratio)], [out], profiler)[0]
+
+    def extend_variants(self, frames, variants, outs=None, profiler=None):
+        """
+        Extend a stack of same-sized frames for several (position, extension_ratio) variants
+
+        Each variant looks up and stores its own cache entries, so every
+        result matches extend_batch. Variants with the same position share
+        the analysis of the frame edge: the dominant edge colors, and for
+        bottom extensions the blurred reflection, are computed once for the
+        tallest extension and reused by the shorter ones.
+
+        Args:
+            frames: uint8 numpy array of shape (N, height, width, 3), RGB or BGR
+            variants: List of (position, extension_ratio) pairs
+            outs: Optional list with a preallocated output array (or None) per variant
+            profiler: Optional StageProfiler that receives the cache lookup time
+
+        Returns:
+            List with one uint8 array of shape (N, height + extension_height, width, 3) per variant
+        """
+        count, height, width = frames.shape[:3]
+        results = []
+        # (position, extension_height, extensions, misses, placeholders, hits) per variant
+        lookups = []
+        for index, (position, extension_ratio) in enumerate(variants):
+            extension_height = int(height * extension_ratio)
+            out = outs[index] if outs is not None else None
+            if out is None:
+                out = np.empty((count, height + extension_height, width, 3), dtype=np.uint8)
+
+            if position == "bottom":
+                out[:, :height] = frames
+                extensions = out[:, height:]
+            else:  # top
+                out[:, extension_height:] = frames
+                extensions = out[:, :extension_height]
+
+            # Misses get a placeholder Future so repeats later in the batch hit it
+            misses = []
+            placeholders = []
+            hits = {}
+            start = profiler.clock() if profiler else None
+            for i in range(count):
+                cache_key = self._cache_key(frames[i], position, width, extension_height)
+                extension = self._cache_lookup(cache_key)
+                if extension is None:
+                    placeholder = Future()
+                    self._cache_store(cache_key, placeholder)
+                    misses.append(i)
+                    placeholders.append(placeholder)
+                else:
+                    hits[i] = extension
+            if profiler:
+                profiler.since('cache_lookup', start, count)
+
+            results.append(out)
+            lookups.append((position, extension_height, extensions, misses, placeholders, hits))
+
+        try:
+            self._render_variants(frames, lookups)
+        except BaseException as e:
+            for lookup in lookups:
+                for placeholder in lookup[4]:
+                    if not placeholder.done():
+                        placeholder.set_exception(e)
+            raise
+
+        for _, _, extensions, _, _, hits in lookups:
+            for i, extension in hits.items():
+                extensions[i] = self._resolve(extension)
+
+        return results
+
+    def _render_variants(self, frames, lookups):
+        """Render the cache misses of every variant, sharing the edge analysis per position"""
+        width = frames.shape[2]
+        analyses = {}
+        if self.scale >= 1:
+            for position in {lookup[0] for lookup in lookups}:
+                missed = sorted({i for lookup in lookups if lookup[0] == position for i in lookup[3]})
+                if missed:
+                    heights = [lookup[1] for lookup in lookups if lookup[0] == position and lookup[3]]
+                    analysis = self._edge_analysis(
+                        frames[missed], position, heights, self.BLUR_SIGMA, self.BLUR_MARGIN
+                    )
+                    analyses[position] = (missed, analysis)
+
+        for position, extension_height, extensions, misses, placeholders, _ in lookups:
+            if not misses:
+                continue
+            analysis = None
+            if position in analyses:
+                missed, analysis = analyses[position]
+                if misses != missed:
+                    analysis = self._select_analysis(analysis, [missed.index(i) for i in misses])
+
+            if len(misses) == len(frames):
+                rendered = self._render_extensions(
+                    frames, position, width, extension_height, extensions, analysis=analysis
+                )
+            else:
+                rendered = np.empty((len(misses), extension_height, width, 3), dtype=np.uint8)
+                self._render_extensions(
+                    frames[misses], position, width, extension_height, rendered, analysis=analysis
+                )
+                extensions[misses] = rendered
+
+            # The output buffer may be reused by the caller, so the cache keeps copies
+            for placeholder, extension in zip(placeholders, rendered):
+                placeholder.set_result(extension.copy())
+
+    def measure_quality(self, frame, position="bottom", extension_ratio=1.0):
+        """
+        Compare this extender's extension of a frame with a full-resolution render
+
+        Both are rendered fresh, bypassing the cache.
+
+        Args:
+            frame: uint8 numpy array of shape (height, width, 3)
+            position: "top" or "bottom"
+            extension_ratio: How much to extend relative to original height
+
+        Returns:
+            Dict with the scale, 'psnr' (dB) and 'ssim' of the extension
+        """
+        height, width = frame.shape[:2]
+        extension_height = int(height * extension_ratio)
+        if extension_height == 0:
+            return {'scale': self.scale, 'psnr': float('inf'), 'ssim': 1.0}
+
+        reference = self._render_extension(frame, position, width, extension_height, scale=1.0)
+        extension = self._render_extension(frame, position, width, extension_height)
+        return {'scale': self.scale, 'psnr': psnr(reference, extension), 'ssim': ssim(reference, extension)}
+
+    def _compose(self, frame, extension, position):
+        """
+        Stack a frame and its extension into a new canvas
+
+        Args:
+            frame: uint8 numpy array of the original frame
+            extension: uint8 numpy array of the extension (or a Future resolving to one)
+            position: "top" or "bottom"
+
+        Returns:
+            uint8 numpy array of the extended frame
+        """
+        extension = self._resolve(extension)
+        height, width = frame.shape[:2]
+        extension_height = extension.shape[0]
+
+        new_frame = np.empty((height + extension_height, width, 3), dtype=np.uint8)
         if position == "bottom":
-            new_img = Image.new("RGB", (width, height + extension_height), (0, 0, 0))
-            new_img.paste(image, (0, 0))
-            
-            # Generate the extension using local method
-            extension = self._generate_extension_locally(image, position, width, extension_height)
-            new_img.paste(extension, (0, height))
-            
+            new_frame[:height] = frame
+            new_frame[height:] = extension
         else:  # top
-            new_img = Image.new("RGB", (width, height + extension_height), (0, 0, 0))
-            new_img.paste(image, (0, extension_height))
-            
-            # Generate the extension using local method
-            extension = self._generate_extension_locally(image, position, width, extension_height)
-            new_img.paste(extension, (0, 0))
-        
-        return new_img
-    
-    def _generate_extension_locally(self, image, position, width, extension_height):
+            new_frame[:extension_height] = extension
+            new_frame[extension_height:] = frame
+
+        return new_frame
+
+    def _generate_extension_locally(self, frame, position, width, extension_height, profiler=None):
         """
         Generate an extension using local image processing techniques
-        
+
+        Args:
+            frame: uint8 numpy array of the frame to extend
+            position: "top" or "bottom"
+            width: Width of extension
+            extension_height: Height of extension
+            profiler: Optional StageProfiler that receives the cache lookup time
+
+        Returns:
+            uint8 numpy array of the extension, shape (extension_height, width, 3)
+        """
+        # Check cache first using a fingerprint of the source rows
+        start = profiler.clock() if profiler else None
+        cache_key = self._cache_key(frame, position, width, extension_height)
+        extension = self._cache_lookup(cache_key)
+        if profiler:
+            profiler.since('cache_lookup', start)
+        if extension is not None:
+            return self._resolve(extension)
+
+        extension = self._render_extension(frame, position, width, extension_height)
+
+        # Store in cache for future similar frames
+        self._cache_store(cache_key, extension)
+
+        return extension
+
+    def _cache_key(self, frame, position, width, extension_height):
+        """Fingerprint the rows of a frame that its extension is generated from"""
+        # Render settings are part of the key so persisted entries from other settings never match
+        return self.extension_cache.fingerprint(
+            frame, position, width, extension_height, self.BLUR_SIGMA, self.BLUR_MARGIN, self.scale
+        )
+
+    def _cache_lookup(self, cache_key):
+        """
+        Look up a cached extension
+
+        Returns:
+            The cached extension (an array, or a Future while a parallel render
+            is still in flight) or None on a miss
+        """
+        key, bucket, sample = cache_key
+        # Hits are counted by the cache (see cache_stats), not logged per frame
+        return self.extension_cache.get(key, bucket, sample)
+
+    def _cache_store(self, cache_key, extension):
+        """
+        Store an extension in the cache
+
+        A Future may be stored for an extension that is still rendering; it is
+        swapped for the finished array once the render completes.
+        """
+        key, bucket, sample = cache_key
+        position, width, extension_height = bucket[:3]
+        nbytes = width * extension_height * 3
+        self.extension_cache.put(key, extension, nbytes, bucket, sample)
+
+        if isinstance(extension, Future):
+            extension.add_done_callback(lambda future: self._cache_settle(key, future))
+
+    def _cache_settle(self, key, future):
+        """Replace a finished Future in the cache with its result (or drop it if it failed)"""
+        if future.exception() is not None:
+            self.extension_cache.discard(key, future)
+        else:
+            self.extension_cache.replace(key, future, future.result())
+
+    @staticmethod
+    def _resolve(extension):
+        """Wait for an extension that may still be rendering on another thread"""
+        if isinstance(extension, Future):
+            return extension.result()
+        return extension
+
+    def _render_extension(self, frame, position, width, extension_height, scale=None):
+        """
+        Build the extension strip: a blurred reflection of the edge rows faded
+        into the dominant edge color
+
         Args:
-            image: PIL Image object to extend
+            frame: uint8 numpy array of the frame to extend
             position: "top" or "bottom"
             width: Width of extension
             extension_height: Height of extension
-            
+            scale: Overrides the extender's render scale
+
         Returns:
-            PIL Image of the extension
+            uint8 numpy array of the extension, shape (extension_height, width, 3)
         """
-        # Check cache first using a hash of the edge pixels
+        extension = np.empty((1, extension_height, width, 3), dtype=np.uint8)
+        self._render_extensions(frame[np.newaxis], position, width, extension_height, extension, scale)
+        return extension[0]
+
+    def _render_extensions(self, frames, position, width, extension_height, out, scale=None, analysis=None):
+        """
+        Render the extensions of a stack of same-sized frames in one go
+
+        Single frames go through here too (as a batch of one), so batched and
+        per-frame output are identical. Below full scale, the source rows are
+        downscaled, rendered with a proportionally smaller blur and upsampled
+        into out.
+
+        Args:
+            frames: uint8 numpy array of shape (N, height, width, 3)
+            position: "top" or "bottom"
+            width: Width of extension
+            extension_height: Height of extension
+            out: uint8 array (or view) of shape (N, extension_height, width, 3) to render into
+            scale: Overrides the extender's render scale
+            analysis: Optional edge analysis of frames from _edge_analysis (full scale only)
+        """
+        scale = self.scale if scale is None else scale
+        if scale >= 1:
+            return self._render_strips(
+                frames, position, width, extension_height, out, self.BLUR_SIGMA, self.BLUR_MARGIN, analysis
+            )
+        if extension_height == 0:
+            return out
+
+        # Only the rows the reflection and the dominant color come from are needed
+        height = frames.shape[1]
+        source_height = min(height, max(extension_height * 2, 10))
         if position == "bottom":
-            edge_region = image.crop((0, image.height - 20, width, image.height))
+            sources = frames[:, height - source_height:]
         else:
-            edge_region = image.crop((0, 0, width, 20))
-        
-        # Create a simple hash for the edge region
-        edge_hash = str(np.array(edge_region).sum())
-        cache_key = f"{position}_{width}_{extension_height}_{edge_hash}"
-        
-        if cache_key in self.extension_cache:
-            self.cache_hits += 1
-            print(f"[Cache hit] Using cached extension for similar frame")
-            return self.extension_cache[cache_key]
-        
-        self.cache_misses += 1
-        
-        # Method 1: Reflection and blur
+            sources = frames[:, :source_height]
+
+        small_width = max(int(round(width * scale)), 1)
+        small_height = max(int(round(extension_height * scale)), 1)
+        small_source_height = max(int(round(source_height * scale)), 1)
+
+        small_sources = np.empty((len(frames), small_source_height, small_width, 3), dtype=np.uint8)
+        for source, small_source in zip(sources, small_sources):
+            cv2.resize(source, (small_width, small_source_height), dst=small_source, interpolation=cv2.INTER_AREA)
+
+        strips = np.empty((len(frames), small_height, small_width, 3), dtype=np.uint8)
+        self._render_strips(
+            small_sources, position, small_width, small_height, strips,
+            self.BLUR_SIGMA * scale, int(np.ceil(self.BLUR_MARGIN * scale))
+        )
+
+        for strip, extension in zip(strips, out):
+            cv2.resize(strip, (width, extension_height), dst=extension, interpolation=cv2.INTER_LINEAR)
+        return out
+
+    def _render_strips(self, frames, position, width, extension_height, out, sigma, margin, analysis=None):
+        """
+        Render extensions at the resolution of frames
+
+        Args:
+            frames: uint8 numpy array of shape (N, height, width, 3)
+            position: "top" or "bottom"
+            width: Width of extension
+            extension_height: Height of extension
+            out: uint8 array (or view) of shape (N, extension_height, width, 3) to render into
+            sigma: Blur strength
+            margin: Rows blurred beyond the visible strip
+            analysis: Optional result of _edge_analysis for frames covering extension_height
+        """
+        height = frames.shape[1]
+        if analysis is None:
+            analysis = self._edge_analysis(frames, position, [extension_height], sigma, margin)
+        colors, reflections = analysis
+        colors = colors[:, np.newaxis, np.newaxis, :]
+
+        # Base extension filled with the edge color
+        out[:] = colors
+
+        reflection_height = min(height, extension_height * 2)
+        # Only the first extension_height rows of the reflection ever land in the canvas
+        visible_height = min(reflection_height, extension_height)
+        if visible_height == 0:
+            return out
+
         if position == "bottom":
-            # For bottom extension, create reflection and gradient
-            reflection_height = min(image.height, extension_height * 2)
-            reflection_region = image.crop((0, image.height - reflection_height, width, image.height))
-            reflection = ImageOps.flip(reflection_region)
-            
-            # Blur the reflection and adjust brightness
-            reflection = reflection.filter(ImageFilter.GaussianBlur(radius=5))
-            
-            # Create gradient mask for smooth transition
-            gradient = Image.new('L', (width, reflection_height), 0)
-            for y in range(reflection_height):
+            # If reflection is smaller than needed extension, center it
+            paste_y = max((extension_height - reflection_height) // 2, 0)
+        else:  # top
+            # Align the reflection with the bottom of the extension
+            paste_y = max(extension_height - reflection_height, 0)
+
+        reflections = reflections[extension_height]
+
+        # Blend the reflections over the base colors: (r * a + c * (255 - a)) / 255
+        alpha, inverse_alpha = self._get_gradient(position, reflection_height, visible_height)
+        blended = reflections * alpha
+        blended += colors * inverse_alpha + 127
+        blended //= 255
+        out[:, paste_y:paste_y + visible_height] = blended
+
+        return out
+
+    def _edge_analysis(self, frames, position, extension_heights, sigma, margin):
+        """
+        Dominant edge colors and blurred reflections of frames for several extension heights
+
+        Only the visible rows of a reflection plus a margin are blurred; rows
+        further away cannot reach them. A bottom reflection always starts at
+        the last row, so a shorter one is a prefix of a taller one's blurred
+        rows whenever its own window ends at least a kernel radius past its
+        visible rows (or ends at the same row), and it is cut from that.
+
+        Args:
+            frames: uint8 numpy array of shape (N, height, width, 3)
+            position: "top" or "bottom"
+            extension_heights: Extension heights to prepare reflections for
+            sigma: Blur strength
+            margin: Rows blurred beyond the visible strip
+
+        Returns:
+            (colors, reflections): uint16 array of shape (N, 3), and a dict mapping
+            each extension height with visible rows to its blurred, mirrored
+            reflection rows of shape (N, visible_height, width, 3)
+        """
+        height = frames.shape[1]
+        colors = self._get_dominant_colors(frames, position)
+        radius = int(np.ceil(3 * sigma))
+
+        reflections = {}
+        tallest = None
+        for extension_height in sorted(set(extension_heights), reverse=True):
+            reflection_height = min(height, extension_height * 2)
+            visible_height = min(reflection_height, extension_height)
+            if visible_height == 0:
+                continue
+            window_height = min(reflection_height, visible_height + margin)
+
+            if position == "bottom":
+                if tallest is not None and (
+                        window_height == tallest[0] or window_height - visible_height >= radius):
+                    reflections[extension_height] = tallest[1][:, :visible_height]
+                    continue
+                # Mirror the bottom rows so the reflection starts at the seam
+                blurred = self._blur(frames[:, height - window_height:][:, ::-1], sigma)
+                if tallest is None:
+                    tallest = (window_height, blurred)
+            else:  # top
+                # Mirror the top portion of the frame
+                blurred = self._blur(frames[:, reflection_height - window_height:reflection_height][:, ::-1], sigma)
+            reflections[extension_height] = blurred[:, :visible_height]
+        return colors, reflections
+
+    @staticmethod
+    def _select_analysis(analysis, rows):
+        """The edge analysis of a subset of the frames it was computed for"""
+        colors, reflections = analysis
+        return colors[rows], {extension_height: strips[rows] for extension_height, strips in reflections.items()}
+
+    def _blur(self, strips, sigma):
+        """
+        Gaussian-blur a stack of strips with two separable passes
+
+        Each pass is a single OpenCV call over the whole stack. The strips are
+        laid out row-major as (rows, N * width): the vertical pass then filters
+        every column of every strip independently, and the same buffer read
+        as (rows * N) lines of width pixels lets the horizontal pass filter
+        every line independently, so no pixel is filtered across two strips.
+
+        Args:
+            strips: uint8 array of shape (N, rows, width, 3), may be a strided view
+            sigma: Blur strength
+
+        Returns:
+            Blurred uint8 array of the same shape (a transposed view)
+        """
+        count, rows, width = strips.shape[:3]
+        ksize = 2 * int(np.ceil(3 * sigma)) + 1
+
+        lines = np.ascontiguousarray(strips.transpose(1, 0, 2, 3))
+
+        # Vertical pass (OpenCV's fixed-point path for 8-bit images)
+        lines = cv2.GaussianBlur(
+            lines.reshape(rows, count * width, 3), (1, ksize), 0,
+            sigmaY=sigma, borderType=cv2.BORDER_REPLICATE
+        )
+
+        # Horizontal pass
+        kernel = self._get_blur_kernel(ksize, sigma)
+        lines = cv2.sepFilter2D(
+            lines.reshape(rows * count, width, 3), -1, kernel, np.ones(1),
+            borderType=cv2.BORDER_REPLICATE
+        )
+        return lines.reshape(rows, count, width, 3).transpose(1, 0, 2, 3)
+
+    def _get_blur_kernel(self, ksize, sigma):
+        """1D Gaussian kernel of ksize taps for sigma"""
+        kernel = self.gradient_cache.get(('blur_kernel', ksize, sigma))
+        if kernel is None:
+            kernel = cv2.getGaussianKernel(ksize, sigma)
+            self.gradient_cache[('blur_kernel', ksize, sigma)] = kernel
+        return kernel
+
+    def _get_gradient(self, position, reflection_height, visible_height):
+        """
+        Get the alpha gradient for a reflection strip, building it on first use
+
+        Returns:
+            Tuple (alpha, 255 - alpha) of uint16 arrays shaped (visible_height, 1, 1)
+            so they broadcast across the width and channels of the strip
+        """
+        key = (position, reflection_height, visible_height)
+        gradient = self.gradient_cache.get(key)
+        if gradient is None:
+            rows = np.arange(visible_height, dtype=np.float64) / reflection_height
+            if position == "bottom":
                 # Gradient gets darker as we go down
-                gradient_value = int(255 * (1 - y / reflection_height))
-                for x in range(width):
-                    gradient.putpixel((x, y), gradient_value)
-            
-            # Apply gradient mask
-            reflection.putalpha(gradient)
-            
-            # Create base extension image
-            extension = Image.new("RGB", (width, extension_height), self._get_dominant_color(image, 'bottom'))
-            
-            # Calculate paste position to align with the bottom of the original image
-            paste_y = 0
-            if reflection_height < extension_height:
-                # If reflection is smaller than needed extension, center it
-                paste_y = (extension_height - reflection_height) // 2
-            
-            # Paste reflection onto extension
-            extension.paste(reflection, (0, paste_y), reflection.getchannel('A'))
-            
-        else:  # top extension
-            # For top extension, mirror and blur the top portion
-            reflection_height = min(image.height, extension_height * 2)
-            reflection_region = image.crop((0, 0, width, reflection_height))
-            reflection = ImageOps.flip(reflection_region)
-            
-            # Blur the reflection and adjust brightness
-            reflection = reflection.filter(ImageFilter.GaussianBlur(radius=5))
-            
-            # Create gradient mask for smooth transition
-            gradient = Image.new('L', (width, reflection_height), 0)
-            for y in range(reflection_height):
-                # Gradient gets darker as we go up
-                gradient_value = int(255 * (y / reflection_height))
-                for x in range(width):
-                    gradient.putpixel((x, y), gradient_value)
-            
-            # Apply gradient mask
-            reflection.putalpha(gradient)
-            
-            # Create base extension image
-            extension = Image.new("RGB", (width, extension_height), self._get_dominant_color(image, 'top'))
-            
-            # Calculate paste position
-            paste_y = extension_height - reflection_height
-            if paste_y < 0:
-                paste_y = 0
-            
-            # Paste reflection onto extension
-            extension.paste(reflection, (0, paste_y), reflection.getchannel('A'))
-        
-        # Store in cache for future similar frames
-        self.extension_cache[cache_key] = extension
-        
-        # Limit cache size to avoid memory issues
-        if len(self.extension_cache) > 100:
-            # Remove oldest items
-            oldest_keys = list(self.extension_cache.keys())[:20]
-            for key in oldest_keys:
-                del self.extension_cache[key]
-        
-        return extension
-    
-    def _get_dominant_color(self, image, position):
-        """Get dominant color from edge of image for seamless extension"""
+                rows = 1 - rows
+            # For top extensions the gradient gets darker as we go up
+            alpha = (255 * rows).astype(np.uint16).reshape(-1, 1, 1)
+            gradient = (alpha, 255 - alpha)
+            self.gradient_cache[key] = gradient
+        return gradient
+
+    def _get_dominant_color(self, frame, position):
+        """Get dominant color from edge of frame for seamless extension"""
+        return tuple(map(int, self._get_dominant_colors(frame[np.newaxis], position)[0]))
+
+    def _get_dominant_colors(self, frames, position):
+        """
+        Get the dominant edge color of every frame in a stack
+
+        Returns:
+            uint16 array of shape (N, 3)
+        """
         if position == 'bottom':
             # Sample from bottom edge
-            edge = image.crop((0, image.height - 10, image.width, image.height))
+            edges = frames[:, -10:]
         else:
             # Sample from top edge
-            edge = image.crop((0, 0, image.width, 10))
-        
-        # Convert to numpy array for processing
-        np_img = np.array(edge)
-        
+            edges = frames[:, :10]
+
         # Reshape and compute average color
-        pixels = np_img.reshape(-1, 3)
-        
+        pixels = edges.reshape(len(frames), -1, 3)
+
         # Simple approach: average the pixels
-        avg_color = tuple(map(int, np.mean(pixels, axis=0)))
-        
+        avg_colors = np.mean(pixels, axis=1).astype(np.uint16)
+
         # More sophisticated approach: find dominant color cluster
         # You could use K-means clustering here for better results
-        
-        return avg_color
\ No newline at end of file
+
+        return avg_colors
+
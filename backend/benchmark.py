@@ -0,0 +1,287 @@
+# Benchmarks the processing pipeline on synthetic clips and writes the results as JSON
+#
+# Usage:
+#   python backend/benchmark.py --quick --output bench.json
+#   python backend/benchmark.py --resolutions 1280x720,1920x1080 --seconds 10 --compare bench.json
+import argparse
+import contextlib
+import io
+import itertools
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import shutil
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+import cv2
+import numpy as np
+from PIL import Image
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from encoders import ffmpeg_available, open_video_writer
+
+
+CONTENT_TYPES = ('static', 'motion', 'cuts')
+
+
+def make_clip(path, width, height, seconds, content, fps=24, seed=0):
+    """
+    Write a synthetic test video
+
+    Args:
+        path: Where to write the clip
+        width: Frame width
+        height: Frame height
+        seconds: Duration
+        content: "static" (a still scene with sensor noise), "motion" (a
+            panning scene) or "cuts" (panning scenes with a hard cut every 2 seconds)
+        fps: Frame rate
+        seed: Seed for the random scenes, so clips are reproducible
+    """
+    rng = np.random.default_rng(seed)
+
+    def scene():
+        # Smooth random texture twice as wide as the frame, so it can pan
+        small = rng.integers(0, 256, (9, 32, 3), dtype=np.uint8)
+        return cv2.resize(small, (width * 2, height), interpolation=cv2.INTER_CUBIC)
+
+    texture = scene()
+    writer = open_video_writer(path, fps, (width, height), {'preset': 'veryfast', 'crf': 18})
+    try:
+        for frame_idx in range(int(seconds * fps)):
+            if content == 'static':
+                frame = texture[:, :width].copy()
+                noise = rng.integers(-2, 3, frame.shape, dtype=np.int16)
+                frame = np.clip(frame + noise, 0, 255).astype(np.uint8)
+            else:
+                if content == 'cuts' and frame_idx and frame_idx % (2 * fps) == 0:
+                    texture = scene()
+                offset = (frame_idx * 4) % width
+                frame = np.ascontiguousarray(texture[:, offset:offset + width])
+            writer.write(frame)
+    except BaseException:
+        writer.abort()
+        raise
+    writer.release()
+
+
+def peak_rss_mb():
+    """Peak resident set size of this process in MB"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+def run_case(case):
+    """
+    Run one benchmark case (inside its own process, so peak RSS is per case)
+
+    Args:
+        case: Dict with the clip and the mode/parameters to run
+
+    Returns:
+        The case with its measurements added
+    """
+    from jobs import ProcessingJob
+    from video_processing import VideoProcessor
+
+    video_path = case['clip']
+    output_dir = tempfile.mkdtemp(prefix='bench-output-')
+    processor = VideoProcessor(output_dir, workers=case['workers'], extension_scale=case['extension_scale'])
+    position = case['position']
+    extension_ratio = case['extension_ratio']
+    frames = case['frames']
+    # Collects the stats and stage timings a job would report
+    job = ProcessingJob()
+
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            if case['mode'] == 'extend_frame':
+                cap = cv2.VideoCapture(video_path)
+                images = []
+                while True:
+                    ret, frame = cap.read()
+                    if not ret:
+                        break
+                    images.append(Image.fromarray(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)))
+                    # Keep memory bounded on long clips
+                    if len(images) == 32:
+                        break
+                cap.release()
+                frames = len(images)
+                start = time.perf_counter()
+                for image in images:
+                    processor.ai_extender.extend_frame(image, position, extension_ratio)
+                total = time.perf_counter() - start
+                job.profiler.observe('extend', total, frames)
+
+            elif case['mode'] == 'process_video':
+                start = time.perf_counter()
+                processor.process_video(
+                    video_path, position, extension_ratio, sample_rate=case['sample_rate'], job=job
+                )
+                total = time.perf_counter() - start
+
+            else:  # process_video_keyframes
+                start = time.perf_counter()
+                processor.process_video_keyframes(
+                    video_path, position, extension_ratio,
+                    keyframe_interval=case['keyframe_interval'], adaptive=case['adaptive'], job=job
+                )
+                total = time.perf_counter() - start
+
+        cache = processor.ai_extender.cache_stats()
+        case.update({
+            'frames': frames,
+            'seconds': total,
+            'fps': frames / total if total > 0 else None,
+            'stages': {stage: timing['seconds'] for stage, timing in job.profiler.summary().items()},
+            'peak_rss_mb': peak_rss_mb(),
+            'cache_hit_rate': cache['hit_rate'],
+            'cache_hits': cache['hits'],
+            'cache_misses': cache['misses'],
+            'job_stats': job.stats,
+        })
+    finally:
+        shutil.rmtree(output_dir, ignore_errors=True)
+    return case
+
+
+def build_cases(clips, args):
+    """Expand the parameter grid for every clip"""
+    cases = []
+    for clip in clips:
+        base = dict(clip, position=args.position, extension_ratio=args.extension_ratio,
+                    workers=1, extension_scale=1.0, sample_rate=1, keyframe_interval=None, adaptive=None)
+        for sample_rate, scale in itertools.product(args.sample_rates, args.scales):
+            cases.append(dict(base, mode='process_video', sample_rate=sample_rate, extension_scale=scale))
+        for workers in args.workers:
+            if workers > 1:
+                cases.append(dict(base, mode='process_video', workers=workers))
+        for interval, adaptive in itertools.product(args.keyframe_intervals, (False, True)):
+            cases.append(dict(base, mode='process_video_keyframes', keyframe_interval=interval, adaptive=adaptive))
+        cases.append(dict(base, mode='extend_frame'))
+    return cases
+
+
+def case_key(case):
+    """Identity of a case across runs, for comparisons"""
+    return json.dumps({
+        key: case[key] for key in (
+            'mode', 'width', 'height', 'seconds_long', 'content', 'position', 'extension_ratio',
+            'workers', 'extension_scale', 'sample_rate', 'keyframe_interval', 'adaptive',
+        )
+    }, sort_keys=True)
+
+
+def compare(results, baseline_path):
+    """Print the fps change of every case also present in a previous results file"""
+    with open(baseline_path) as f:
+        baseline = {case_key(case): case for case in json.load(f)['results']}
+
+    print(f"\nCompared with {baseline_path}:")
+    for case in results:
+        previous = baseline.get(case_key(case))
+        if previous is None or not previous.get('fps') or not case.get('fps'):
+            continue
+        change = case['fps'] / previous['fps'] - 1
+        flag = "  <-- slower" if change < -0.1 else ""
+        print(f"  {describe(case):70s} {previous['fps']:8.1f} -> {case['fps']:8.1f} fps ({change:+.0%}){flag}")
+
+
+def describe(case):
+    """One-line summary of a case"""
+    details = [f"{case['width']}x{case['height']}", case['content'], case['mode']]
+    if case['mode'] == 'process_video':
+        details.append(f"sample_rate={case['sample_rate']} scale={case['extension_scale']} workers={case['workers']}")
+    elif case['mode'] == 'process_video_keyframes':
+        details.append(f"interval={case['keyframe_interval']}" + (" adaptive" if case['adaptive'] else ""))
+    return " ".join(details)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark video processing on synthetic clips")
+    parser.add_argument('--output', default='benchmark.json', help="Where to write the JSON results")
+    parser.add_argument('--compare', help="Previous results file to compare against")
+    parser.add_argument('--quick', action='store_true', help="Small grid for a fast smoke run (grid flags given explicitly still apply)")
+    parser.add_argument('--resolutions', default='640x360,1280x720,1920x1080',
+                        help="Comma-separated WIDTHxHEIGHT list")
+    parser.add_argument('--seconds', type=float, nargs='+', default=[5.0], help="Clip durations")
+    parser.add_argument('--content', default=','.join(CONTENT_TYPES), help="Comma-separated content types")
+    parser.add_argument('--position', default='bottom', choices=('top', 'bottom'))
+    parser.add_argument('--extension-ratio', type=float, default=1.0)
+    parser.add_argument('--sample-rates', type=int, nargs='+', default=[1, 4])
+    parser.add_argument('--scales', type=float, nargs='+', default=[1.0, 0.5])
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, os.cpu_count() or 1])
+    parser.add_argument('--keyframe-intervals', type=int, nargs='+', default=[24])
+    parser.add_argument('--keep-clips', action='store_true', help="Leave the generated clips in place")
+    args = parser.parse_args(argv)
+
+    if args.quick:
+        quick = {'resolutions': '640x360', 'seconds': [2.0], 'sample_rates': [1], 'scales': [1.0], 'workers': [1]}
+        for name, value in quick.items():
+            if getattr(args, name) == parser.get_default(name):
+                setattr(args, name, value)
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    resolutions = [tuple(int(value) for value in resolution.split('x')) for resolution in args.resolutions.split(',')]
+    contents = args.content.split(',')
+
+    clip_dir = tempfile.mkdtemp(prefix='bench-clips-')
+    results = []
+    try:
+        clips = []
+        for (width, height), seconds, content in itertools.product(resolutions, args.seconds, contents):
+            path = os.path.join(clip_dir, f"{content}_{width}x{height}_{seconds:g}s.mp4")
+            print(f"Generating {path}")
+            make_clip(path, width, height, seconds, content)
+            clips.append({
+                'clip': path, 'width': width, 'height': height, 'seconds_long': seconds,
+                'content': content, 'frames': int(seconds * 24),
+            })
+
+        # Every case runs in a fresh process: cold caches and its own peak RSS
+        context = multiprocessing.get_context('spawn')
+        for case in build_cases(clips, args):
+            with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+                result = pool.submit(run_case, case).result()
+            result.pop('clip')
+            results.append(result)
+            print(f"{describe(result):70s} {result['fps']:8.1f} fps  {result['peak_rss_mb']:7.1f} MB  "
+                  f"hit rate {result['cache_hit_rate']:.0%}")
+    finally:
+        if args.keep_clips:
+            print(f"Clips kept in {clip_dir}")
+        else:
+            shutil.rmtree(clip_dir, ignore_errors=True)
+
+    report = {
+        'created_at': time.time(),
+        'environment': {
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'numpy': np.__version__,
+            'opencv': cv2.__version__,
+            'encoder': 'libx264 (ffmpeg)' if ffmpeg_available() else 'mp4v (OpenCV)',
+        },
+        'results': results,
+    }
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {args.output}")
+
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == '__main__':
+    main()
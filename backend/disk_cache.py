@@ -0,0 +1,180 @@
+# Persistent extension cache shared by every worker process on the machine
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+
+
+class DiskExtensionCache:
+    """
+    On-disk tier for ExtensionCache: .npy blobs indexed by a sqlite database
+
+    Blobs are written to a temporary file and renamed into place, and the
+    index runs in WAL mode, so any number of processes can read and write the
+    same directory concurrently. Entries are evicted least recently used first
+    once the total size passes max_bytes. Writes that arrive while
+    max_pending are already queued are dropped rather than held in memory.
+    """
+
+    def __init__(self, directory, max_bytes=1024 * 1024 * 1024, max_pending=16):
+        """
+        Args:
+            directory: Where the blobs and index.sqlite are stored
+            max_bytes: Max total size of the stored extensions
+            max_pending: Max extensions queued for writing at once
+        """
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.index_path = os.path.join(directory, "index.sqlite")
+        os.makedirs(directory, exist_ok=True)
+
+        self._local = threading.local()
+        # Writes happen off the processing thread, one at a time
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="disk-cache")
+        self._pending = threading.BoundedSemaphore(max_pending)
+
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.dropped_writes = 0
+        self.evictions = 0
+
+        with self._connect() as db:
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS extensions ("
+                " key TEXT PRIMARY KEY, filename TEXT NOT NULL,"
+                " nbytes INTEGER NOT NULL, last_used REAL NOT NULL)"
+            )
+            db.execute("CREATE INDEX IF NOT EXISTS extensions_last_used ON extensions (last_used)")
+
+    def get(self, key):
+        """
+        Load an extension from disk
+
+        Returns:
+            The extension array, or None if it is not stored
+        """
+        db = self._connect()
+        row = db.execute("SELECT filename FROM extensions WHERE key = ?", (key,)).fetchone()
+        if row is not None:
+            try:
+                extension = np.load(os.path.join(self.directory, row[0]))
+            except (OSError, ValueError):
+                # Evicted by another process between the lookup and the read;
+                # drop the row too in case it was re-added after the file went
+                extension = None
+                with db:
+                    db.execute("DELETE FROM extensions WHERE key = ?", (key,))
+            if extension is not None:
+                with db:
+                    db.execute("UPDATE extensions SET last_used = ? WHERE key = ?", (time.time(), key))
+                self.hits += 1
+                return extension
+
+        self.misses += 1
+        return None
+
+    def put(self, key, extension):
+        """Queue an extension to be written to disk in the background, unless the queue is full"""
+        if not self._pending.acquire(blocking=False):
+            self.dropped_writes += 1
+            return
+        try:
+            self._writer.submit(self._write, key, extension)
+        except BaseException:
+            self._pending.release()
+            raise
+
+    def flush(self):
+        """Wait for queued writes to finish"""
+        self._writer.submit(lambda: None).result()
+
+    def stats(self):
+        db = self._connect()
+        entries, total_bytes = db.execute("SELECT COUNT(*), COALESCE(SUM(nbytes), 0) FROM extensions").fetchone()
+        return {
+            'directory': self.directory,
+            'entries': entries,
+            'bytes': total_bytes,
+            'max_bytes': self.max_bytes,
+            'hits': self.hits,
+            'misses': self.misses,
+            'writes': self.writes,
+            'dropped_writes': self.dropped_writes,
+            'evictions': self.evictions,
+        }
+
+    def _write(self, key, extension):
+        try:
+            self._store(key, extension)
+        finally:
+            self._pending.release()
+
+    def _store(self, key, extension):
+        db = self._connect()
+        if db.execute("SELECT 1 FROM extensions WHERE key = ?", (key,)).fetchone():
+            return
+
+        filename = os.path.join(key[:2], f"{key}.npy")
+        path = os.path.join(self.directory, filename)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        # Write under a temporary name so readers never see a partial blob
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                np.save(f, extension)
+            os.replace(temp_path, path)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+
+        with db:
+            db.execute(
+                "INSERT OR REPLACE INTO extensions (key, filename, nbytes, last_used) VALUES (?, ?, ?, ?)",
+                (key, filename, extension.nbytes, time.time()),
+            )
+        self.writes += 1
+        self._evict(db)
+
+    def _evict(self, db):
+        """Delete least recently used entries until the store fits in max_bytes"""
+        if self.max_bytes is None:
+            return
+
+        with db:
+            total_bytes = db.execute("SELECT COALESCE(SUM(nbytes), 0) FROM extensions").fetchone()[0]
+            if total_bytes <= self.max_bytes:
+                return
+
+            evicted = []
+            for key, filename, nbytes in db.execute(
+                "SELECT key, filename, nbytes FROM extensions ORDER BY last_used"
+            ).fetchall():
+                if total_bytes <= self.max_bytes:
+                    break
+                evicted.append((key, filename))
+                total_bytes -= nbytes
+            db.executemany("DELETE FROM extensions WHERE key = ?", [(key,) for key, _ in evicted])
+
+        # Files go after the rows; a reader that loses the race just sees a miss
+        for _, filename in evicted:
+            try:
+                os.remove(os.path.join(self.directory, filename))
+            except FileNotFoundError:
+                pass
+        self.evictions += len(evicted)
+
+    def _connect(self):
+        """sqlite connection for the calling thread"""
+        db = getattr(self._local, "db", None)
+        if db is None:
+            db = sqlite3.connect(self.index_path, timeout=30)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            self._local.db = db
+        return db
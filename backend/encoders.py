@@ -0,0 +1,198 @@
+# Video encoders: stream raw frames into ffmpeg, or fall back to OpenCV
+import os
+import shutil
+import subprocess
+import tempfile
+import cv2
+import numpy as np
+
+
+# Defaults for the libx264 encode, overridable per job
+DEFAULT_ENCODER_OPTIONS = {
+    'preset': 'fast',
+    'crf': 22,
+    'threads': 0,  # 0 lets x264 pick based on the CPU count
+    # Move the MP4/MOV index to the front once encoded, so playback can start
+    # before the download finishes
+    'faststart': True,
+}
+
+# Containers whose index ffmpeg can move to the front of the file
+FASTSTART_EXTENSIONS = ('.mp4', '.mov', '.m4v')
+
+
+def faststart_args(output_path):
+    """ffmpeg arguments that put the index of output_path first, if its container has one"""
+    if os.path.splitext(output_path)[1].lower() in FASTSTART_EXTENSIONS:
+        return ['-movflags', '+faststart']
+    return []
+
+
+def output_extension(input_path):
+    """
+    File extension for an H.264 encode of input_path
+
+    ffmpeg picks the muxer from the extension, and containers like WebM
+    cannot hold H.264, so only MP4-family inputs keep their extension.
+    """
+    ext = os.path.splitext(input_path)[1].lower()
+    return ext if ext in FASTSTART_EXTENSIONS else '.mp4'
+
+X264_PRESETS = (
+    'ultrafast', 'superfast', 'veryfast', 'faster', 'fast',
+    'medium', 'slow', 'slower', 'veryslow',
+)
+
+
+class FFmpegPipeWriter:
+    """Encode BGR frames to H.264 in one pass by piping raw video into ffmpeg"""
+
+    def __init__(self, output_path, fps, dimensions, preset="fast", crf=22, threads=0, faststart=True,
+                 ffmpeg_path="ffmpeg"):
+        """
+        Args:
+            output_path: Where to write the video
+            fps: Frames per second of the output
+            dimensions: (width, height) of every frame
+            preset: x264 speed/compression preset
+            crf: x264 constant rate factor (lower = better quality, bigger file)
+            threads: x264 encoder threads (0 = automatic)
+            faststart: Put the MP4/MOV index at the front of the file (costs one
+                extra pass over the file when the encode finishes)
+            ffmpeg_path: ffmpeg executable
+        """
+        width, height = dimensions
+        self.output_path = output_path
+        self.frame_size = width * height * 3
+
+        command = [
+            ffmpeg_path, '-y', '-loglevel', 'error',
+            # Raw BGR frames arrive on stdin
+            '-f', 'rawvideo', '-pix_fmt', 'bgr24', '-s', f'{width}x{height}', '-r', str(fps),
+            '-i', 'pipe:0',
+            '-an', '-c:v', 'libx264', '-preset', str(preset), '-crf', str(crf),
+            '-threads', str(threads), '-pix_fmt', 'yuv420p',
+        ]
+        if width % 2 or height % 2:
+            # yuv420p needs even dimensions, so pad by one pixel where required
+            command += ['-vf', 'pad=ceil(iw/2)*2:ceil(ih/2)*2']
+        if faststart:
+            command += faststart_args(output_path)
+        command.append(output_path)
+
+        # ffmpeg's errors go to a file so a chatty encoder can never fill a pipe and stall
+        self._stderr = tempfile.TemporaryFile()
+        self.process = subprocess.Popen(command, stdin=subprocess.PIPE, stderr=self._stderr)
+
+    def write(self, frame):
+        """Send one BGR uint8 frame to the encoder"""
+        if frame.size != self.frame_size:
+            raise ValueError(f"Frame has {frame.size} values, expected {self.frame_size}")
+        try:
+            self.process.stdin.write(np.ascontiguousarray(frame).data)
+        except BrokenPipeError:
+            self.process.wait()
+            raise RuntimeError(f"ffmpeg exited while encoding: {self._error_output()}")
+
+    def release(self):
+        """Finish the encode and wait for ffmpeg to write the file"""
+        try:
+            self.process.stdin.close()
+        except BrokenPipeError:
+            pass
+        returncode = self.process.wait()
+        error_output = self._error_output()
+        self._stderr.close()
+        if returncode != 0:
+            raise RuntimeError(f"ffmpeg failed with exit code {returncode}: {error_output}")
+
+    def abort(self):
+        """Stop the encoder without finishing the file"""
+        self.process.kill()
+        self.process.wait()
+        self._stderr.close()
+
+    def _error_output(self):
+        self._stderr.seek(0)
+        return self._stderr.read().decode(errors='replace').strip()
+
+
+class OpenCVWriter:
+    """cv2.VideoWriter fallback (mp4v) used when ffmpeg is not installed"""
+
+    def __init__(self, output_path, fps, dimensions):
+        self.output_path = output_path
+        fourcc = cv2.VideoWriter_fourcc(*'mp4v')
+        self.video_writer = cv2.VideoWriter(output_path, fourcc, fps, dimensions)
+        if not self.video_writer.isOpened():
+            raise RuntimeError(f"Could not open video writer for {output_path}")
+
+    def write(self, frame):
+        self.video_writer.write(frame)
+
+    def release(self):
+        self.video_writer.release()
+
+    def abort(self):
+        self.video_writer.release()
+
+
+def ffmpeg_available():
+    """Path to the ffmpeg executable, or None if it is not installed"""
+    return shutil.which(os.environ.get('FFMPEG_BINARY', 'ffmpeg'))
+
+
+def open_video_writer(output_path, fps, dimensions, encoder_options=None):
+    """
+    Open the best available encoder for output_path
+
+    Args:
+        output_path: Where to write the video
+        fps: Frames per second of the output
+        dimensions: (width, height) of every frame
+        encoder_options: Overrides for DEFAULT_ENCODER_OPTIONS (preset, crf, threads)
+
+    Returns:
+        A writer with write(frame), release() and abort()
+    """
+    ffmpeg_path = ffmpeg_available()
+    if ffmpeg_path is None:
+        # OpenCV cannot write faststart files, so players wait for the whole download
+        print("ffmpeg not found, falling back to OpenCV mp4v encoding")
+        return OpenCVWriter(output_path, fps, dimensions)
+
+    options = {**DEFAULT_ENCODER_OPTIONS, **(encoder_options or {})}
+    return FFmpegPipeWriter(output_path, fps, dimensions, ffmpeg_path=ffmpeg_path, **options)
+
+
+def concat_videos(segment_paths, output_path, faststart=True):
+    """
+    Join videos encoded with identical settings into one, without re-encoding
+
+    Args:
+        segment_paths: Videos to join, in order
+        output_path: Where to write the joined video
+        faststart: Put the MP4/MOV index at the front of the joined file
+
+    Raises:
+        RuntimeError: If ffmpeg is missing or fails
+    """
+    ffmpeg_path = ffmpeg_available()
+    if ffmpeg_path is None:
+        raise RuntimeError("ffmpeg is required to join video segments")
+
+    # The concat demuxer reads its inputs from a list file
+    with tempfile.NamedTemporaryFile('w', suffix='.txt', delete=False) as list_file:
+        for path in segment_paths:
+            escaped = os.path.abspath(path).replace("'", "'\\''")
+            list_file.write(f"file '{escaped}'\n")
+    try:
+        result = subprocess.run(
+            [ffmpeg_path, '-y', '-loglevel', 'error', '-f', 'concat', '-safe', '0',
+             '-i', list_file.name, '-c', 'copy', *(faststart_args(output_path) if faststart else []), output_path],
+            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+        )
+    finally:
+        os.remove(list_file.name)
+    if result.returncode != 0:
+        raise RuntimeError(f"ffmpeg concat failed: {result.stderr.decode(errors='replace').strip()}")
@@ -0,0 +1,255 @@
+# Content-addressed LRU cache for generated frame extensions
+import hashlib
+import itertools
+import threading
+from collections import OrderedDict
+import numpy as np
+
+
+class ExtensionCache:
+    """
+    LRU cache of rendered extensions keyed by a fingerprint of the source rows
+
+    The fingerprint hashes every pixel of the rows next to the seam, where
+    the reflection is nearly opaque and the edge color comes from, plus a
+    strided sample of the rows further away, so lookups stay cheap while
+    frames that differ only at the seam (e.g. a ticker) never share a key.
+
+    With a tolerance set, a miss falls back to the closest cached sample of
+    the same shape whose mean difference is within the tolerance, among the
+    NEAR_CANDIDATES most recently used entries of its shape bucket.
+
+    An optional DiskExtensionCache adds a persistent second tier: finished
+    extensions are written through to it, and exact-key misses in memory are
+    looked up there before rendering.
+    """
+
+    # Upper bound on sampled rows/columns per fingerprint, beyond the seam rows
+    SAMPLE_ROWS = 32
+    SAMPLE_COLS = 64
+    # Rows next to the seam hashed in full (covers the extender's edge color band)
+    SEAM_ROWS = 32
+    # Most entries a tolerance lookup compares against (it runs under the lock)
+    NEAR_CANDIDATES = 64
+
+    def __init__(self, max_entries=100, max_bytes=256 * 1024 * 1024, tolerance=0.0, disk=None):
+        """
+        Args:
+            max_entries: Max cached extensions (None for no limit)
+            max_bytes: Max total size of cached extensions (None for no limit)
+            tolerance: Mean absolute difference (0-255) under which a cached
+                extension is reused for a frame with a different fingerprint
+            disk: Optional DiskExtensionCache shared across processes and restarts
+        """
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.tolerance = tolerance
+        self.disk = disk
+
+        # key -> (value, nbytes, bucket, sample)
+        self._entries = OrderedDict()
+        # bucket -> OrderedDict of key -> sample in LRU order, for tolerance lookups
+        self._buckets = {}
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.near_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def fingerprint(self, frame, position, width, extension_height, *params):
+        """
+        Fingerprint the rows of a frame that an extension is generated from
+
+        Args:
+            frame: uint8 numpy array of the frame
+            position: "top" or "bottom"
+            width: Width of extension
+            extension_height: Height of extension
+            *params: Any other render settings that change the output
+
+        Returns:
+            (key, bucket, sample): the cache key, the shape bucket used for
+            tolerance matching, and the sampled pixels
+        """
+        height = frame.shape[0]
+
+        # The reflection is taken from at most twice the extension height;
+        # rows are ordered from the seam outwards
+        source_height = max(min(height, extension_height * 2), 1)
+        if position == "bottom":
+            source = frame[height - source_height:][::-1]
+        else:
+            source = frame[:source_height]
+
+        # Every pixel near the seam, then a stride over the rest
+        row_step = max((source_height - self.SEAM_ROWS) // self.SAMPLE_ROWS, 1)
+        col_step = max(width // self.SAMPLE_COLS, 1)
+        seam = np.ascontiguousarray(source[:self.SEAM_ROWS])
+        rest = np.ascontiguousarray(source[self.SEAM_ROWS::row_step, ::col_step])
+        # Always a copy: callers may decode the next frame into the same buffer
+        sample = np.concatenate([seam[:, ::col_step], rest])
+
+        bucket = (position, width, extension_height) + params
+        digest = hashlib.blake2b(seam.data, digest_size=16)
+        digest.update(rest.data)
+        digest.update(repr(bucket).encode())
+        return digest.hexdigest(), bucket, sample
+
+    def get(self, key, bucket=None, sample=None):
+        """
+        Look up an extension and mark it as recently used
+
+        Returns:
+            The cached value or None on a miss
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self.hits += 1
+                self._touch(key, entry[2])
+                return entry[0]
+
+        # Exact matches from the persistent tier beat near matches in memory
+        if self.disk is not None:
+            extension = self.disk.get(key)
+            if extension is not None:
+                with self._lock:
+                    self.hits += 1
+                    self.disk_hits += 1
+                self._insert(key, extension, extension.nbytes, bucket, sample)
+                return extension
+
+        with self._lock:
+            if self.tolerance > 0 and sample is not None:
+                near_key = self._nearest(bucket, sample)
+                if near_key is not None:
+                    self.hits += 1
+                    self.near_hits += 1
+                    self._touch(near_key, bucket)
+                    return self._entries[near_key][0]
+
+            self.misses += 1
+            return None
+
+    def put(self, key, value, nbytes, bucket=None, sample=None):
+        """
+        Store an extension, evicting least recently used entries past the limits
+
+        Args:
+            key: Cache key from fingerprint()
+            value: The extension (or a Future that will resolve to it)
+            nbytes: Size of the extension in bytes
+            bucket: Shape bucket from fingerprint(), for tolerance matching
+            sample: Sampled pixels from fingerprint(), for tolerance matching
+        """
+        self._insert(key, value, nbytes, bucket, sample)
+
+        # Futures are written through once they resolve (see replace())
+        if self.disk is not None and isinstance(value, np.ndarray):
+            self.disk.put(key, value)
+
+    def _insert(self, key, value, nbytes, bucket, sample):
+        """Add an entry to the in-memory tier and evict past the limits"""
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._bytes -= previous[1]
+                self._unindex(key, previous[2])
+
+            self._entries[key] = (value, nbytes, bucket, sample)
+            self._bytes += nbytes
+            if self.tolerance > 0 and sample is not None:
+                self._buckets.setdefault(bucket, OrderedDict())[key] = sample
+
+            while self._entries and (
+                (self.max_entries is not None and len(self._entries) > self.max_entries)
+                or (self.max_bytes is not None and self._bytes > self.max_bytes)
+            ):
+                evicted_key, (_, evicted_bytes, evicted_bucket, _) = self._entries.popitem(last=False)
+                self._bytes -= evicted_bytes
+                self._unindex(evicted_key, evicted_bucket)
+                self.evictions += 1
+
+    def replace(self, key, expected, value):
+        """Swap an entry's value in place if it still holds expected (keeps its LRU position)"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] is not expected:
+                return
+            self._entries[key] = (value,) + entry[1:]
+
+        if self.disk is not None:
+            self.disk.put(key, value)
+
+    def discard(self, key, expected=None):
+        """Drop an entry (only if it still holds expected, when given)"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and (expected is None or entry[0] is expected):
+                del self._entries[key]
+                self._bytes -= entry[1]
+                self._unindex(key, entry[2])
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._buckets.clear()
+            self._bytes = 0
+
+    def stats(self):
+        """Hit/miss/eviction counters and current size"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            stats = {
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'max_entries': self.max_entries,
+                'max_bytes': self.max_bytes,
+                'tolerance': self.tolerance,
+                'hits': self.hits,
+                'near_hits': self.near_hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+            }
+        if self.disk is not None:
+            stats['disk'] = self.disk.stats()
+        return stats
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def _touch(self, key, bucket):
+        """Mark an entry as most recently used (caller holds the lock)"""
+        self._entries.move_to_end(key)
+        candidates = self._buckets.get(bucket)
+        if candidates is not None and key in candidates:
+            candidates.move_to_end(key)
+
+    def _unindex(self, key, bucket):
+        """Drop an entry from the tolerance index (caller holds the lock)"""
+        candidates = self._buckets.get(bucket)
+        if candidates is not None:
+            candidates.pop(key, None)
+            if not candidates:
+                del self._buckets[bucket]
+
+    def _nearest(self, bucket, sample):
+        """Key of the closest recently used same-bucket entry within the tolerance, or None"""
+        best_key = None
+        best_diff = self.tolerance
+        candidates = self._buckets.get(bucket, {})
+        for key, entry_sample in itertools.islice(reversed(candidates.items()), self.NEAR_CANDIDATES):
+            if entry_sample.shape != sample.shape:
+                continue
+            diff = np.abs(entry_sample.astype(np.int16) - sample).mean()
+            if diff <= best_diff:
+                best_key, best_diff = key, diff
+        return best_key
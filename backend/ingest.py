@@ -0,0 +1,328 @@
+# Streams uploads to disk and lets processing read them while they are still arriving
+import hashlib
+import re
+import struct
+import subprocess
+import threading
+import cv2
+import numpy as np
+from encoders import ffmpeg_available
+
+
+class UploadAborted(Exception):
+    """Raised to readers of an upload that stopped before it was complete"""
+
+
+def streamable_container(read_at, size):
+    """
+    Whether a container can be decoded front to back from its first bytes
+
+    MPEG-TS and Matroska/WebM always can. MP4/MOV only can when the moov
+    index comes before the media data (a "faststart" or fragmented file).
+
+    Args:
+        read_at: Callable (offset, length) -> bytes reading the file so far
+        size: Bytes of the file available so far
+
+    Returns:
+        True or False, or None when more bytes are needed to tell
+    """
+    head = read_at(0, 12)
+    if len(head) < 12:
+        return None
+    if head[0] == 0x47:
+        # MPEG-TS: 188-byte packets starting with a sync byte
+        if size < 189:
+            return None
+        return read_at(188, 1) == b'\x47'
+    if head[:4] == b'\x1a\x45\xdf\xa3':
+        # EBML header: Matroska or WebM
+        return True
+    if head[4:8] not in (b'ftyp', b'moov', b'mdat', b'free', b'skip', b'wide', b'pnot'):
+        return False
+
+    # Walk the top-level MP4 boxes until moov/moof or mdat shows up
+    offset = 0
+    while offset + 8 <= size:
+        box_size, box_type = struct.unpack('>I4s', read_at(offset, 8))
+        if box_type in (b'moov', b'moof'):
+            return True
+        if box_type == b'mdat':
+            return False
+        if box_size == 1:
+            if offset + 16 > size:
+                return None
+            box_size = struct.unpack('>Q', read_at(offset + 8, 8))[0]
+        if box_size < 8:
+            # Zero means "to the end of the file", anything else smaller is corrupt
+            return False
+        offset += box_size
+    return None
+
+
+class UploadIngest:
+    """
+    Writes an upload to disk in chunks, hashing it on the way
+
+    Readers (see StreamingCapture) can follow the file while it grows: they
+    block until more bytes have been written, the upload is finished, or it
+    has been aborted.
+    """
+
+    def __init__(self, path):
+        """
+        Args:
+            path: Where to write the upload
+        """
+        self.path = path
+        self.size = 0
+        self.complete = False
+        self.error = None
+        self.streamable = None
+        # Hex SHA-256 of the content, once complete
+        self.digest = None
+        self._file = open(path, 'wb')
+        self._digest = hashlib.sha256()
+        self._changed = threading.Condition()
+
+    def write(self, chunk):
+        """Append the next chunk of the upload"""
+        self._file.write(chunk)
+        # Readers open the file separately, so the bytes must reach the OS first
+        self._file.flush()
+        self._digest.update(chunk)
+        with self._changed:
+            self.size += len(chunk)
+            self._changed.notify_all()
+        if self.streamable is None:
+            self.streamable = streamable_container(self._read_at, self.size)
+
+    def ingest(self, stream, chunk_size=1024 * 1024, on_chunk=None):
+        """
+        Copy a readable binary stream to disk and finish the upload
+
+        Args:
+            stream: File-like object (e.g. a request's body stream)
+            chunk_size: Bytes read per chunk
+            on_chunk: Optional callable run after every chunk is written
+
+        Returns:
+            Hex SHA-256 digest of the content
+        """
+        try:
+            while True:
+                chunk = stream.read(chunk_size)
+                if not chunk:
+                    break
+                self.write(chunk)
+                if on_chunk is not None:
+                    on_chunk()
+        except BaseException as e:
+            self.abort(e)
+            raise
+        return self.finish()
+
+    def finish(self):
+        """Mark the upload complete; returns the hex SHA-256 digest of the content"""
+        self._file.close()
+        self.digest = self._digest.hexdigest()
+        with self._changed:
+            self.complete = True
+            self._changed.notify_all()
+        return self.digest
+
+    def abort(self, error=None):
+        """Stop the upload; readers waiting for more bytes get UploadAborted"""
+        self._file.close()
+        with self._changed:
+            self.error = error or UploadAborted("Upload was aborted")
+            self._changed.notify_all()
+
+    def read_from(self, source, offset, length):
+        """
+        Read up to length bytes at offset, waiting for them to arrive
+
+        Args:
+            source: Binary file object opened on self.path by the reader
+            offset: Where to read
+            length: Most bytes to return
+
+        Returns:
+            The bytes, or b'' once offset is past the end of a complete upload
+
+        Raises:
+            UploadAborted: If the upload was aborted
+        """
+        with self._changed:
+            while offset >= self.size and not self.complete and self.error is None:
+                self._changed.wait()
+            if self.error is not None:
+                raise UploadAborted(f"Upload was aborted: {self.error}")
+            length = min(length, self.size - offset)
+        if length <= 0:
+            return b''
+        source.seek(offset)
+        return source.read(length)
+
+    def _read_at(self, offset, length):
+        with open(self.path, 'rb') as source:
+            source.seek(offset)
+            return source.read(length)
+
+
+class StreamingCapture:
+    """
+    cv2.VideoCapture stand-in that decodes an upload while it is still arriving
+
+    The upload's bytes are fed to an ffmpeg process as they land on disk,
+    and ffmpeg hands back raw BGR frames. The frame count is unknown until
+    the upload ends, so CAP_PROP_FRAME_COUNT reports 0, and the capture
+    cannot seek.
+    """
+
+    def __init__(self, ingest, chunk_size=256 * 1024):
+        """
+        Args:
+            ingest: UploadIngest of the upload to decode
+            chunk_size: Bytes fed to the decoder at a time
+        """
+        ffmpeg_path = ffmpeg_available()
+        if ffmpeg_path is None:
+            raise RuntimeError("ffmpeg is required to decode an upload while it streams in")
+
+        self.ingest = ingest
+        self.chunk_size = chunk_size
+        self.width = 0
+        self.height = 0
+        self.fps = 0.0
+        self.frames_read = 0
+        self.error = None
+
+        self.process = subprocess.Popen(
+            [ffmpeg_path, '-hide_banner', '-nostats', '-i', 'pipe:0',
+             # Every decoded frame comes out exactly once, like cv2.VideoCapture
+             # (-vsync rather than -fps_mode, which ffmpeg 4.x does not know)
+             '-map', '0:v:0', '-an', '-vsync', 'passthrough',
+             '-f', 'rawvideo', '-pix_fmt', 'bgr24', 'pipe:1'],
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+        )
+        self._stderr_lines = []
+        self._format_known = threading.Event()
+        self._feeder = threading.Thread(target=self._feed, daemon=True)
+        self._feeder.start()
+        self._stderr_reader = threading.Thread(target=self._read_stderr, daemon=True)
+        self._stderr_reader.start()
+
+    def isOpened(self):
+        # Blocks until ffmpeg has read enough of the upload to describe the video
+        self._format_known.wait()
+        return self.width > 0 and self.height > 0
+
+    def get(self, prop):
+        self._format_known.wait()
+        if prop == cv2.CAP_PROP_FRAME_WIDTH:
+            return float(self.width)
+        if prop == cv2.CAP_PROP_FRAME_HEIGHT:
+            return float(self.height)
+        if prop == cv2.CAP_PROP_FPS:
+            return self.fps
+        if prop == cv2.CAP_PROP_POS_FRAMES:
+            return float(self.frames_read)
+        return 0.0
+
+    def set(self, prop, value):
+        # A stream cannot seek
+        return False
+
+    def read(self, image=None):
+        """
+        Decode the next frame, into image when given (like cv2.VideoCapture.read)
+
+        Returns:
+            (True, frame) or (False, None) at the end of the video
+
+        Raises:
+            UploadAborted: If the upload stopped before it was complete
+        """
+        if not self.isOpened():
+            return False, None
+        shape = (self.height, self.width, 3)
+        if image is None or image.shape != shape or not image.flags.c_contiguous:
+            image = np.empty(shape, dtype=np.uint8)
+
+        buffer = memoryview(image).cast('B')
+        filled = 0
+        while filled < len(buffer):
+            count = self.process.stdout.readinto(buffer[filled:])
+            if not count:
+                break
+            filled += count
+
+        if filled < len(buffer):
+            # Decoder finished; a short read means the upload never completed
+            self.process.wait()
+            self._stderr_reader.join()
+            if self.ingest.error is not None:
+                raise UploadAborted(f"Upload was aborted: {self.ingest.error}")
+            if self.error is not None:
+                raise RuntimeError(self.error)
+            return False, None
+        self.frames_read += 1
+        return True, image
+
+    def release(self):
+        if self.process.poll() is None:
+            self.process.kill()
+        self.process.wait()
+        # The feeder may be waiting for upload bytes; it exits on its own once
+        # it next writes to the dead decoder or the upload ends
+        self._stderr_reader.join()
+        self.process.stdout.close()
+        self.process.stderr.close()
+
+    def _feed(self):
+        """Copy the upload into ffmpeg as it arrives (runs on its own thread)"""
+        offset = 0
+        try:
+            with open(self.ingest.path, 'rb') as source:
+                while True:
+                    chunk = self.ingest.read_from(source, offset, self.chunk_size)
+                    if not chunk:
+                        break
+                    self.process.stdin.write(chunk)
+                    offset += len(chunk)
+        except (BrokenPipeError, ValueError):
+            # ffmpeg stopped reading (finished, failed or was killed)
+            pass
+        except (UploadAborted, OSError):
+            # The upload was aborted or its file removed: stop the decoder too
+            self.process.kill()
+        finally:
+            try:
+                self.process.stdin.close()
+            except BrokenPipeError:
+                pass
+
+    def _read_stderr(self):
+        """Collect ffmpeg's log and pick the output format out of it (runs on its own thread)"""
+        in_output = False
+        for line in iter(self.process.stderr.readline, b''):
+            line = line.decode(errors='replace').rstrip()
+            self._stderr_lines.append(line)
+            if line.startswith('Output #0'):
+                in_output = True
+            elif 'Video:' in line and not self._format_known.is_set():
+                # e.g. "Stream #0:0: Video: rawvideo (BGR[24] / 0x18524742), bgr24, 320x180, ..., 24 fps, 24 tbn";
+                # the input stream's rate stands in if the output line has none
+                rate = re.search(r', ([\d.]+) (?:fps|tbr)', line)
+                if rate:
+                    self.fps = float(rate.group(1))
+                size = re.search(r', (\d+)x(\d+)', line)
+                if in_output and size:
+                    self.width, self.height = int(size.group(1)), int(size.group(2))
+                    self._format_known.set()
+
+        if not self._format_known.is_set() or self.process.wait() != 0:
+            self.error = "ffmpeg could not decode the upload: " + "\n".join(self._stderr_lines[-5:])
+        # Never leave a reader waiting on a decoder that gave up
+        self._format_known.set()
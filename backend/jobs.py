@@ -0,0 +1,223 @@
+# Background job queue so uploads return immediately while videos process
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from metrics import StageProfiler
+
+
+class JobCancelled(Exception):
+    """Raised inside a running job once it has been cancelled"""
+
+
+class QueueFull(Exception):
+    """Raised when the job queue cannot accept more work"""
+
+
+class ProcessingJob:
+    """State and progress of one queued video processing job"""
+
+    QUEUED = "queued"
+    RUNNING = "running"
+    COMPLETED = "completed"
+    FAILED = "failed"
+    CANCELLED = "cancelled"
+
+    FINISHED_STATES = (COMPLETED, FAILED, CANCELLED)
+
+    def __init__(self, params=None, job_id=None):
+        self.id = job_id or uuid.uuid4().hex
+        self.params = params or {}
+        self.status = self.QUEUED
+        self.frames_done = 0
+        self.frames_total = 0
+        self.stats = {}
+        # Stage timings recorded by the processing code
+        self.profiler = StageProfiler()
+        self.output_path = None
+        self.error = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self._cancel_event = threading.Event()
+
+    @property
+    def finished(self):
+        return self.status in self.FINISHED_STATES
+
+    @property
+    def cancelled(self):
+        return self._cancel_event.is_set()
+
+    def update(self, frames_done=None, frames_total=None, **stats):
+        """
+        Report progress from inside the job
+
+        Args:
+            frames_done: Frames written so far
+            frames_total: Frames the job expects to write
+            **stats: Extra job statistics to expose through the status API
+        """
+        if frames_done is not None:
+            self.frames_done = frames_done
+        if frames_total is not None:
+            self.frames_total = frames_total
+        if stats:
+            self.stats.update(stats)
+
+    def check_cancelled(self):
+        """Raise JobCancelled if the job has been cancelled"""
+        if self._cancel_event.is_set():
+            raise JobCancelled(f"Job {self.id} was cancelled")
+
+    def cancel(self):
+        self._cancel_event.set()
+
+    def to_dict(self):
+        """Snapshot of the job state for the status API"""
+        elapsed = None
+        fps = None
+        eta = None
+        if self.started_at is not None:
+            elapsed = (self.finished_at or time.time()) - self.started_at
+            if elapsed > 0 and self.frames_done:
+                fps = self.frames_done / elapsed
+                if self.status == self.RUNNING and self.frames_total:
+                    eta = max(self.frames_total - self.frames_done, 0) / fps
+
+        return {
+            'job_id': self.id,
+            'status': self.status,
+            'params': self.params,
+            'frames_done': self.frames_done,
+            'frames_total': self.frames_total,
+            'progress': self.frames_done / self.frames_total if self.frames_total else 0.0,
+            'fps': fps,
+            'elapsed_seconds': elapsed,
+            'eta_seconds': eta,
+            'stats': dict(self.stats),
+            'timings': self.profiler.summary(),
+            'error': self.error,
+        }
+
+
+class JobQueue:
+    """Runs jobs on a bounded worker pool and keeps their status for polling"""
+
+    def __init__(self, workers=2, max_pending=16, max_history=200, metrics=None):
+        """
+        Args:
+            workers: Number of jobs processed at the same time
+            max_pending: Jobs allowed to wait for a worker before submissions are rejected
+            max_history: Finished jobs kept for status lookups
+            metrics: Optional MetricsRegistry that every finished job is recorded in
+        """
+        self.workers = workers
+        self.max_pending = max_pending
+        self.max_history = max_history
+        self.metrics = metrics
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="job")
+        self._jobs = OrderedDict()
+        self._futures = {}
+        self._lock = threading.Lock()
+
+    def submit(self, func, *args, params=None, on_finish=None, job_id=None, **kwargs):
+        """
+        Queue func(*args, job=job, **kwargs) and return its job right away
+
+        func should report progress through job.update() and call
+        job.check_cancelled() regularly; its return value is stored as the
+        job's output path. on_finish(job) is called once the job reaches a
+        final state (completed, failed or cancelled). job_id lets the caller
+        name files after the job before it is queued.
+
+        Raises:
+            QueueFull: If workers + max_pending jobs are already queued or running
+        """
+        job = ProcessingJob(params, job_id)
+        with self._lock:
+            active = sum(1 for queued in self._jobs.values() if not queued.finished)
+            if active >= self.workers + self.max_pending:
+                raise QueueFull("Too many videos are being processed, try again later")
+            self._jobs[job.id] = job
+            self._prune()
+            self._futures[job.id] = self._executor.submit(self._run, job, func, args, kwargs, on_finish)
+        return job
+
+    def add_completed(self, output_path, params=None, job_id=None):
+        """Register a job whose output already exists (e.g. a deduplicated upload)"""
+        job = ProcessingJob(params, job_id)
+        job.output_path = output_path
+        job.started_at = job.finished_at = time.time()
+        job.status = ProcessingJob.COMPLETED
+        with self._lock:
+            self._jobs[job.id] = job
+            self._prune()
+        return job
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def cancel(self, job_id):
+        """
+        Cancel a queued or running job
+
+        Returns:
+            The job, or None if it does not exist
+        """
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None or job.finished:
+                return job
+            job.cancel()
+            future = self._futures.get(job_id)
+            if future is not None and future.cancel():
+                # Never started, so no worker will finish it
+                self._finish(job, ProcessingJob.CANCELLED)
+        return job
+
+    def _run(self, job, func, args, kwargs, on_finish):
+        try:
+            self._execute(job, func, args, kwargs)
+        finally:
+            if on_finish is not None:
+                try:
+                    on_finish(job)
+                except Exception as e:
+                    print(f"Job {job.id} completion hook failed: {e}")
+
+    def _execute(self, job, func, args, kwargs):
+        if job.cancelled:
+            self._finish(job, ProcessingJob.CANCELLED)
+            return
+
+        job.status = ProcessingJob.RUNNING
+        job.started_at = time.time()
+        try:
+            job.output_path = func(*args, job=job, **kwargs)
+            self._finish(job, ProcessingJob.COMPLETED)
+        except JobCancelled:
+            self._finish(job, ProcessingJob.CANCELLED)
+        except Exception as e:
+            if job.cancelled:
+                # Failed because its input went away when it was cancelled
+                self._finish(job, ProcessingJob.CANCELLED)
+                return
+            print(f"Job {job.id} failed: {e}")
+            job.error = str(e)
+            self._finish(job, ProcessingJob.FAILED)
+
+    def _finish(self, job, status):
+        job.status = status
+        job.finished_at = time.time()
+        self._futures.pop(job.id, None)
+        if self.metrics is not None:
+            self.metrics.record_job(job)
+
+    def _prune(self):
+        """Forget the oldest finished jobs beyond max_history"""
+        finished = [job_id for job_id, job in self._jobs.items() if job.finished]
+        for job_id in finished[:max(len(finished) - self.max_history, 0)]:
+            del self._jobs[job_id]
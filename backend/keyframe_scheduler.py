@@ -0,0 +1,110 @@
+# Picks keyframes from the content of the edge the extension is generated from
+import cv2
+
+
+# Size (width, height) of the edge thumbnails that are compared
+THUMBNAIL_SIZE = (32, 8)
+
+
+def edge_thumbnail(frame, position, extension_height):
+    """
+    Tiny grayscale copy of the rows an extension is generated from
+
+    Args:
+        frame: BGR uint8 frame
+        position: "top" or "bottom" - where the extension is added
+        extension_height: Height of the extension
+
+    Returns:
+        uint8 array of shape (THUMBNAIL_SIZE[1], THUMBNAIL_SIZE[0])
+    """
+    height = frame.shape[0]
+    source_height = max(min(height, extension_height * 2), 1)
+    if position == "bottom":
+        edge = frame[height - source_height:]
+    else:
+        edge = frame[:source_height]
+
+    # Skip pixels before averaging so large frames stay cheap to score
+    step = max(min(edge.shape[0] // (THUMBNAIL_SIZE[1] * 4), edge.shape[1] // (THUMBNAIL_SIZE[0] * 4)), 1)
+    edge = edge[::step, ::step]
+    thumbnail = cv2.resize(edge, THUMBNAIL_SIZE, interpolation=cv2.INTER_AREA)
+    return cv2.cvtColor(thumbnail, cv2.COLOR_BGR2GRAY)
+
+
+def thumbnail_difference(a, b):
+    """Mean absolute difference (0-255) between two edge thumbnails"""
+    return float(cv2.absdiff(a, b).mean())
+
+
+class KeyframeScheduler:
+    """
+    Decides frame by frame whether a frame should be a keyframe
+
+    Every frame's edge region (the rows its extension is generated from) is
+    reduced to a tiny grayscale thumbnail. A large jump between consecutive
+    thumbnails is a scene cut; a smaller but growing difference from the
+    last keyframe is drift. Both place a keyframe, as does max_interval
+    frames without one, so static shots are extended rarely and cuts are
+    caught on the frame they happen.
+    """
+
+    def __init__(self, position, extension_height, max_interval=96, min_interval=6,
+                 drift_threshold=10.0, cut_threshold=30.0):
+        """
+        Args:
+            position: "top" or "bottom" - where the extension is added
+            extension_height: Height of the extension
+            max_interval: Longest run of frames without a keyframe
+            min_interval: Shortest gap before drift may trigger a keyframe (cuts always do)
+            drift_threshold: Mean thumbnail difference (0-255) from the last
+                keyframe that triggers a new one
+            cut_threshold: Mean thumbnail difference (0-255) between two
+                consecutive frames that counts as a scene cut
+        """
+        self.position = position
+        self.extension_height = extension_height
+        self.max_interval = max(int(max_interval), 1)
+        self.min_interval = max(int(min_interval), 1)
+        self.drift_threshold = drift_threshold
+        self.cut_threshold = cut_threshold
+
+        self.keyframes = 0
+        self.cuts = 0
+
+        self._previous = None
+        self._keyframe = None
+        self._since_keyframe = 0
+
+    def check(self, frame):
+        """
+        Score the next frame of the video
+
+        Args:
+            frame: BGR uint8 frame
+
+        Returns:
+            (is_keyframe, is_cut): is_cut means the frame starts a new scene,
+            so nothing before it may be blended towards it
+        """
+        thumbnail = edge_thumbnail(frame, self.position, self.extension_height)
+        previous, self._previous = self._previous, thumbnail
+        self._since_keyframe += 1
+
+        is_cut = previous is not None and thumbnail_difference(thumbnail, previous) > self.cut_threshold
+        is_keyframe = (
+            previous is None
+            or is_cut
+            or self._since_keyframe >= self.max_interval
+            or (
+                self._since_keyframe >= self.min_interval
+                and thumbnail_difference(thumbnail, self._keyframe) > self.drift_threshold
+            )
+        )
+
+        if is_keyframe:
+            self._keyframe = thumbnail
+            self._since_keyframe = 0
+            self.keyframes += 1
+            self.cuts += int(is_cut)
+        return is_keyframe, is_cut
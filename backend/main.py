@@ -1,8 +1,10 @@
 # Main Flask API to handle video uploads and processing
-from flask import Flask, request, jsonify, render_template, url_for, redirect, send_from_directory
+from flask import Flask, request, jsonify, render_template, url_for, redirect, send_from_directory, send_file
 import os
+import json
 import uuid
 import sys
+import threading
 
 # Get absolute paths
 current_dir = os.path.dirname(os.path.abspath(__file__))
@@ -13,8 +15,19 @@ static_dir = os.path.join(project_root, 'static')
 # Add the current directory to the path so Python can find our modules
 sys.path.append(current_dir)
 
+from werkzeug.security import safe_join
 from werkzeug.utils import secure_filename
 from video_processing import VideoProcessor
+from segments import SegmentedVideoProcessor
+from jobs import JobQueue, QueueFull
+from encoders import X264_PRESETS, ffmpeg_available, output_extension
+from ingest import StreamingCapture, UploadIngest
+from interpolation import INTERPOLATION_MODES
+from extension_cache import ExtensionCache
+from disk_cache import DiskExtensionCache
+from result_store import ResultStore
+from metrics import MetricsRegistry
+from utils import save_and_hash
 
 # Update your Flask app initialization with absolute paths
 app = Flask(__name__, 
@@ -33,8 +46,95 @@ os.makedirs(OUTPUT_FOLDER, exist_ok=True)
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 app.config['MAX_CONTENT_LENGTH'] = 500 * 1024 * 1024  # 500MB max upload size
 
+# Behind nginx or Apache, USE_X_SENDFILE=1 hands output files to the front-end
+# server (X-Sendfile header) instead of streaming them through a Python worker
+app.config['USE_X_SENDFILE'] = os.environ.get('USE_X_SENDFILE', '0') == '1'
+# How long browsers may reuse a downloaded output before revalidating its ETag
+OUTPUT_MAX_AGE = int(os.environ.get('OUTPUT_MAX_AGE', 3600))
+# Longest keyframe interval an upload may ask for; the frames between two
+# keyframes wait in memory (twice as many in adaptive mode)
+MAX_KEYFRAME_INTERVAL = int(os.environ.get('MAX_KEYFRAME_INTERVAL', 48))
+# Most outputs one upload may ask to be rendered from a single decode
+MAX_OUTPUTS = int(os.environ.get('MAX_OUTPUTS', 4))
+
+# Frame extension parallelism (VIDEO_WORKERS=1 processes frames serially)
+VIDEO_WORKERS = int(os.environ.get('VIDEO_WORKERS', os.cpu_count() or 1))
+VIDEO_QUEUE_DEPTH = int(os.environ.get('VIDEO_QUEUE_DEPTH', 0)) or None
+VIDEO_BATCH_SIZE = int(os.environ.get('VIDEO_BATCH_SIZE', 1))
+
+# Extension cache shared by all jobs: EXTENSION_CACHE_MB caps its memory and a
+# non-zero EXTENSION_CACHE_TOLERANCE (mean pixel difference, 0-255) lets
+# near-identical frames reuse each other's extensions. Setting EXTENSION_CACHE_DIR
+# adds a persistent tier (capped at EXTENSION_CACHE_DISK_MB) shared by every
+# worker process and kept across restarts
+disk_cache = None
+if os.environ.get('EXTENSION_CACHE_DIR'):
+    disk_cache = DiskExtensionCache(
+        os.environ['EXTENSION_CACHE_DIR'],
+        max_bytes=int(os.environ.get('EXTENSION_CACHE_DISK_MB', 1024)) * 1024 * 1024,
+    )
+extension_cache = ExtensionCache(
+    max_entries=None,
+    max_bytes=int(os.environ.get('EXTENSION_CACHE_MB', 256)) * 1024 * 1024,
+    tolerance=float(os.environ.get('EXTENSION_CACHE_TOLERANCE', 0)),
+    disk=disk_cache,
+)
+
 # Initialize the video processor - no API key needed
-processor = VideoProcessor(OUTPUT_FOLDER)
+processor = VideoProcessor(
+    OUTPUT_FOLDER, workers=VIDEO_WORKERS, queue_depth=VIDEO_QUEUE_DEPTH, batch_size=VIDEO_BATCH_SIZE,
+    encoder_options={'threads': int(os.environ.get('ENCODER_THREADS', 0))},
+    extension_cache=extension_cache,
+    # Below 1, extensions are generated at this fraction of the resolution and upsampled
+    extension_scale=float(os.environ.get('EXTENSION_SCALE', 1.0))
+)
+
+# With SEGMENT_PROCESSES > 1, long videos are split into GOP-aligned segments of at
+# least SEGMENT_MIN_SECONDS that are processed by that many worker processes
+SEGMENT_PROCESSES = int(os.environ.get('SEGMENT_PROCESSES', 1))
+segmented = SegmentedVideoProcessor(
+    processor, processes=SEGMENT_PROCESSES,
+    min_segment_seconds=float(os.environ.get('SEGMENT_MIN_SECONDS', 20)),
+    retries=int(os.environ.get('SEGMENT_RETRIES', 2))
+)
+
+# Counters and stage timings of every finished job since the server started
+metrics = MetricsRegistry()
+
+# Videos are processed in the background; JOB_WORKERS jobs run at once and up to
+# JOB_QUEUE_SIZE more wait for a worker before uploads are turned away
+jobs = JobQueue(
+    workers=int(os.environ.get('JOB_WORKERS', 2)),
+    max_pending=int(os.environ.get('JOB_QUEUE_SIZE', 16)),
+    metrics=metrics,
+)
+
+# Finished outputs indexed by (upload hash, parameters) so repeated uploads are
+# served without reprocessing. Outputs are kept while a job references them,
+# for at most RESULT_TTL_HOURS unless released earlier with DELETE /api/jobs/<id>
+results = ResultStore(
+    os.environ.get('RESULT_INDEX', os.path.join(project_root, 'data', 'results.sqlite')),
+    ref_ttl=float(os.environ.get('RESULT_TTL_HOURS', 24)) * 60 * 60,
+)
+
+# Jobs still processing, by result key, so identical uploads share one job
+inflight_jobs = {}
+inflight_lock = threading.Lock()
+
+# Previews render inline so they return within seconds: PREVIEW_SECONDS of the
+# video, at most PREVIEW_HEIGHT pixels high, with at most PREVIEW_WORKERS at once
+PREVIEW_SECONDS = float(os.environ.get('PREVIEW_SECONDS', 3))
+PREVIEW_HEIGHT = int(os.environ.get('PREVIEW_HEIGHT', 360))
+preview_slots = threading.BoundedSemaphore(int(os.environ.get('PREVIEW_WORKERS', 2)))
+
+# Previewed uploads are kept for their full render as result store entries, so
+# they expire RESULT_TTL_HOURS after their last preview or render request
+preview_lock = threading.Lock()
+
+def preview_upload_ref(content_hash):
+    """Result store key and stable reference id of a previewed upload"""
+    key = results.result_key(content_hash, {'preview': 'upload'})
+    return key, f"preview:{key}"
 
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
@@ -43,6 +143,272 @@ def allowed_file(filename):
 def index():
     return render_template('index.html')
 
+def parse_upload_options(values):
+    """
+    Read the processing options of an upload from form or query string values
+    
+    Returns:
+        (options, params): everything the processing call needs, and the subset
+        that changes the output (the result store key)
+    
+    Raises:
+        ValueError: If an option is invalid
+    """
+    position = values.get('position', 'bottom')
+    options = {
+        'position': position,
+        'extension_ratio': float(values.get('extension_ratio', 1.0)),
+        'outputs': parse_outputs(values.get('outputs'), position),
+        'use_keyframes': values.get('use_keyframes', 'false') == 'true',
+        'keyframe_interval': int(values.get('keyframe_interval', 24)),
+        'interpolation': values.get('interpolation', 'linear'),
+        'adaptive_keyframes': values.get('adaptive_keyframes', 'false') == 'true',
+        # Capped like VideoProcessor caps it, so equal requests share a result key
+        'sample_rate': min(max(int(values.get('sample_rate', 1)), 1), VideoProcessor.MAX_REUSED_FRAMES),
+        'reuse_threshold': min(max(float(values.get('reuse_threshold', 0)), 0.0), 255.0),
+    }
+    
+    if options['use_keyframes'] and options['interpolation'] not in INTERPOLATION_MODES:
+        raise ValueError(f"Unknown interpolation mode: {options['interpolation']}")
+    if options['use_keyframes'] and not 1 <= options['keyframe_interval'] <= MAX_KEYFRAME_INTERVAL:
+        raise ValueError(f"keyframe_interval must be between 1 and {MAX_KEYFRAME_INTERVAL}")
+    if options['outputs'] and (options['use_keyframes'] or options['sample_rate'] > 1
+                               or options['reuse_threshold'] > 0):
+        raise ValueError("outputs cannot be combined with keyframes, sample_rate or reuse_threshold")
+    
+    # Optional per-job encoder settings
+    encoder_options = {}
+    if values.get('preset'):
+        if values['preset'] not in X264_PRESETS:
+            raise ValueError(f"Unknown preset: {values['preset']}")
+        encoder_options['preset'] = values['preset']
+    if values.get('crf'):
+        encoder_options['crf'] = min(max(int(values['crf']), 0), 51)
+    options['encoder_options'] = encoder_options
+    
+    # Only parameters that change the output, so they can key the result store
+    params = {
+        'position': options['position'],
+        'extension_ratio': options['extension_ratio'],
+        'use_keyframes': options['use_keyframes'],
+        **encoder_options,
+    }
+    if options['use_keyframes']:
+        params['keyframe_interval'] = options['keyframe_interval']
+        params['interpolation'] = options['interpolation']
+        params['adaptive_keyframes'] = options['adaptive_keyframes']
+    else:
+        params['sample_rate'] = options['sample_rate']
+        if options['reuse_threshold'] > 0:
+            params['reuse_threshold'] = options['reuse_threshold']
+    if options['outputs']:
+        params['outputs'] = options['outputs']
+    return options, params
+
+def parse_outputs(value, position):
+    """
+    Read the optional list of outputs to render from one decode
+    
+    Args:
+        value: JSON list of {"position", "extension_ratio"} objects, or None
+        position: Position of entries that leave it out
+    
+    Returns:
+        List of {'position', 'extension_ratio'} dicts (empty for a single output)
+    
+    Raises:
+        ValueError: If the list is malformed
+    """
+    if not value:
+        return []
+    try:
+        entries = json.loads(value)
+    except json.JSONDecodeError as e:
+        raise ValueError(f"outputs is not valid JSON: {e}")
+    if not isinstance(entries, list) or not all(isinstance(entry, dict) for entry in entries):
+        raise ValueError("outputs must be a list of objects")
+    if len(entries) > MAX_OUTPUTS:
+        raise ValueError(f"At most {MAX_OUTPUTS} outputs can be rendered at once")
+    
+    outputs = []
+    for entry in entries:
+        output = {
+            'position': entry.get('position', position),
+            'extension_ratio': float(entry.get('extension_ratio', 1.0)),
+        }
+        if output['position'] not in ('top', 'bottom'):
+            raise ValueError(f"Unknown position: {output['position']}")
+        if output in outputs:
+            raise ValueError("outputs must not repeat a position and extension ratio")
+        outputs.append(output)
+    return outputs
+
+def store_results(job, content_hash, params):
+    """
+    Record a completed job's outputs in the result store
+    
+    Each output of a multi-output job is stored under the parameters a
+    single-output upload would use, so later uploads of either kind reuse it.
+    """
+    if 'outputs' not in params:
+        results.add(results.result_key(content_hash, params), content_hash, params, job.output_path, job.id)
+        return
+    
+    base_params = {key: value for key, value in params.items() if key != 'outputs'}
+    for index, (output, output_path) in enumerate(zip(params['outputs'], job.output_path)):
+        output_params = {**base_params, **output}
+        results.add(
+            results.result_key(content_hash, output_params), content_hash, output_params, output_path,
+            f"{job.id}:{index}"
+        )
+
+def process_streamed(ingest, process, *args, job=None, **kwargs):
+    """Run a processing call on an upload that may still be arriving"""
+    return process(*args, job=job, capture=StreamingCapture(ingest), **kwargs)
+
+def submit_job(filepath, options, params, on_finish, ingest=None):
+    """
+    Queue the processing of an upload
+    
+    Args:
+        filepath: Where the upload is (or is being) written
+        options: Processing options from parse_upload_options
+        params: Result store parameters of the job
+        on_finish: Called with the job once it finishes
+        ingest: UploadIngest to decode while it is still arriving, instead of the file
+    
+    Raises:
+        QueueFull: If the job queue cannot take the job
+    """
+    position = options['position']
+    extension_ratio = options['extension_ratio']
+    # Outputs are named after the job: a previewed upload is rendered with many parameters
+    job_id = uuid.uuid4().hex
+    if options['outputs']:
+        # Every output from one decode; the extension is not split into segments
+        process = processor.process_video_multi
+        args = (filepath, options['outputs'])
+        kwargs = {'output_paths': [
+            output_path_for(filepath, job_id, f"_vertical_{output['position']}_{output['extension_ratio']:g}")
+            for output in options['outputs']
+        ]}
+    elif options['use_keyframes']:
+        process = processor.process_video_keyframes
+        args = (filepath, position, extension_ratio, options['keyframe_interval'])
+        kwargs = {'interpolation': options['interpolation'], 'adaptive': options['adaptive_keyframes']}
+    else:
+        # A stream is read front to back, so it cannot be split into segments
+        process = segmented.process_video if ingest is None else processor.process_video
+        args = (filepath, position, extension_ratio, None, options['sample_rate'])
+        kwargs = {'reuse_threshold': options['reuse_threshold']}
+    kwargs['encoder_options'] = options['encoder_options']
+    if not options['outputs']:
+        kwargs['output_path'] = output_path_for(filepath, job_id)
+    
+    if ingest is not None:
+        return jobs.submit(
+            process_streamed, ingest, process, *args, params=params, on_finish=on_finish, job_id=job_id, **kwargs
+        )
+    return jobs.submit(process, *args, params=params, on_finish=on_finish, job_id=job_id, **kwargs)
+
+def output_path_for(filepath, name_id, suffix="_vertical"):
+    """
+    Output path for an upload that no other job or preview writes to
+    
+    Args:
+        filepath: The upload
+        name_id: Job id or result key the file belongs to
+        suffix: Added after the upload's name
+    """
+    name, _ = os.path.splitext(os.path.basename(filepath))
+    return os.path.join(OUTPUT_FOLDER, f"{name}{suffix}_{name_id}{output_extension(filepath)}")
+
+def queue_upload(filepath, content_hash, options, params, keep_upload=False):
+    """
+    Queue a complete upload for processing, unless its result already exists
+    or is being produced by another job
+    
+    Args:
+        keep_upload: Never delete the upload, even when it is not needed
+            (e.g. a previewed upload that may be rendered again)
+    
+    Returns:
+        Flask response
+    """
+    def discard_upload():
+        if not keep_upload:
+            os.remove(filepath)
+    
+    results.collect_garbage()
+    result_key = results.result_key(content_hash, params)
+    
+    if options['outputs']:
+        # Multi-output jobs always run; their outputs are stored one by one for later uploads
+        def on_finish(job):
+            if job.status == job.COMPLETED:
+                store_results(job, content_hash, params)
+        
+        try:
+            job = submit_job(filepath, options, params, on_finish)
+        except QueueFull as e:
+            discard_upload()
+            return jsonify({'error': str(e)}), 503
+        return jsonify({
+            'success': True,
+            'job_id': job.id,
+            'status_url': url_for('job_status', job_id=job.id),
+            'message': 'Video queued for processing'
+        }), 202
+    
+    with inflight_lock:
+        # Same file with the same parameters already processed: reuse the output
+        job_id = uuid.uuid4().hex
+        output_path = results.claim(result_key, job_id)
+        if output_path is not None:
+            discard_upload()
+            metrics.increment('uploads_deduplicated')
+            job = jobs.add_completed(output_path, params, job_id)
+            return jsonify({
+                'success': True,
+                'job_id': job.id,
+                'status_url': url_for('job_status', job_id=job.id),
+                'message': 'Video already processed'
+            }), 200
+        
+        # Same file still processing: follow the running job
+        job = inflight_jobs.get(result_key)
+        if job is not None and not job.finished:
+            discard_upload()
+            return jsonify({
+                'success': True,
+                'job_id': job.id,
+                'status_url': url_for('job_status', job_id=job.id),
+                'message': 'Video queued for processing'
+            }), 202
+        
+        def on_finish(job):
+            # Stored before the job stops being in flight, so an identical upload
+            # always finds one or the other
+            if job.status == job.COMPLETED:
+                store_results(job, content_hash, params)
+            with inflight_lock:
+                inflight_jobs.pop(result_key, None)
+        
+        # Queue the video for processing and return right away
+        try:
+            job = submit_job(filepath, options, params, on_finish)
+        except QueueFull as e:
+            discard_upload()
+            return jsonify({'error': str(e)}), 503
+        inflight_jobs[result_key] = job
+    
+    return jsonify({
+        'success': True,
+        'job_id': job.id,
+        'status_url': url_for('job_status', job_id=job.id),
+        'message': 'Video queued for processing'
+    }), 202
+
 @app.route('/upload', methods=['POST'])
 def upload_file():
     # Check if a file was uploaded
@@ -55,60 +421,325 @@ def upload_file():
     if file.filename == '':
         return jsonify({'error': 'No selected file'}), 400
     
-    if file and allowed_file(file.filename):
-        # Generate unique filename to avoid conflicts
-        filename = secure_filename(file.filename)
-        unique_filename = f"{uuid.uuid4()}_{filename}"
-        filepath = os.path.join(app.config['UPLOAD_FOLDER'], unique_filename)
-        
-        # Save the uploaded file
-        file.save(filepath)
-        
-        # Get parameters from form
-        position = request.form.get('position', 'bottom')
-        extension_ratio = float(request.form.get('extension_ratio', 1.0))
-        use_keyframes = request.form.get('use_keyframes', 'false') == 'true'
-        keyframe_interval = int(request.form.get('keyframe_interval', 24))
-        sample_rate = int(request.form.get('sample_rate', 1))
+    if not allowed_file(file.filename):
+        return jsonify({'error': 'File type not allowed'}), 400
+    
+    # Get parameters from form
+    try:
+        options, params = parse_upload_options(request.form)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    # Generate unique filename to avoid conflicts
+    filename = secure_filename(file.filename)
+    unique_filename = f"{uuid.uuid4()}_{filename}"
+    filepath = os.path.join(app.config['UPLOAD_FOLDER'], unique_filename)
+    
+    # Save the uploaded file, hashing it as it streams to disk
+    content_hash = save_and_hash(file.stream, filepath)
+    return queue_upload(filepath, content_hash, options, params)
+
+@app.route('/upload/stream', methods=['POST'])
+def upload_stream():
+    """
+    Upload a video as the raw request body and start processing it while it arrives
+    
+    The file name and processing options come from the query string (same
+    names as the /upload form fields). Streamable containers (MPEG-TS,
+    Matroska/WebM, MP4/MOV with the index first) are decoded as their bytes
+    land on disk; other files are processed once complete, like /upload.
+    """
+    filename = secure_filename(request.args.get('filename', ''))
+    if not allowed_file(filename):
+        return jsonify({'error': 'File type not allowed'}), 400
+    
+    try:
+        options, params = parse_upload_options(request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    unique_filename = f"{uuid.uuid4()}_{filename}"
+    filepath = os.path.join(app.config['UPLOAD_FOLDER'], unique_filename)
+    ingest = UploadIngest(filepath)
+    # The job started while the upload arrives, or False once it will wait for the whole file
+    early_job = [None]
+    
+    def on_finish(job):
+        # The content hash is known by now: decoding only ends with the upload
+        if ingest.digest is None:
+            return
+        if job.status == job.COMPLETED:
+            store_results(job, ingest.digest, params)
+        result_key = results.result_key(ingest.digest, params)
+        with inflight_lock:
+            if inflight_jobs.get(result_key) is job:
+                inflight_jobs.pop(result_key)
+    
+    def start_early():
+        if early_job[0] is not None or ingest.streamable is None:
+            return
+        early_job[0] = False
+        if ingest.streamable and ffmpeg_available():
+            try:
+                early_job[0] = submit_job(filepath, options, params, on_finish, ingest)
+            except QueueFull:
+                # Retried, with deduplication, once the upload is complete
+                pass
+    
+    try:
+        content_hash = ingest.ingest(request.stream, on_chunk=start_early)
+    except BaseException:
+        # Client went away or sent too much: stop the job reading it
+        if early_job[0]:
+            jobs.cancel(early_job[0].id)
+        if os.path.exists(filepath):
+            os.remove(filepath)
+        raise
+    
+    job = early_job[0]
+    if not job:
+        return queue_upload(filepath, content_hash, options, params)
+    
+    if not options['outputs']:
+        # Only now is the content known: drop the early job if its result already
+        # exists or another job is producing it, exactly like queue_upload
+        result_key = results.result_key(content_hash, params)
+        with inflight_lock:
+            output_path = None
+            running = None
+            if not job.finished:
+                duplicate_id = uuid.uuid4().hex
+                output_path = results.claim(result_key, duplicate_id)
+                running = inflight_jobs.get(result_key)
+                if running is not None and running.finished:
+                    running = None
+                if output_path is None and running is None:
+                    inflight_jobs[result_key] = job
         
-        # Process the video
-        try:
-            if use_keyframes:
-                output_path = processor.process_video_keyframes(
-                    filepath, position, extension_ratio, keyframe_interval
-                )
-            else:
-                output_path = processor.process_video(
-                    filepath, position, extension_ratio, None, sample_rate
-                )
-            
-            # Get relative path for the frontend
-            relative_output = os.path.relpath(output_path, static_dir)
-            
+        if output_path is not None or running is not None:
+            jobs.cancel(job.id)
+            os.remove(filepath)
+        if output_path is not None:
+            metrics.increment('uploads_deduplicated')
+            job = jobs.add_completed(output_path, params, duplicate_id)
             return jsonify({
                 'success': True,
-                'output_video': f'/static/{relative_output}',
-                'message': 'Video processed successfully!'
+                'job_id': job.id,
+                'status_url': url_for('job_status', job_id=job.id),
+                'message': 'Video already processed'
             }), 200
-        
-        except Exception as e:
+        if running is not None:
             return jsonify({
-                'error': f'Error processing video: {str(e)}'
-            }), 500
+                'success': True,
+                'job_id': running.id,
+                'status_url': url_for('job_status', job_id=running.id),
+                'message': 'Video queued for processing'
+            }), 202
+    
+    metrics.increment('uploads_streamed')
+    return jsonify({
+        'success': True,
+        'job_id': job.id,
+        'status_url': url_for('job_status', job_id=job.id),
+        'message': 'Video processing started during upload'
+    }), 202
+
+@app.route('/preview', methods=['POST'])
+def preview_upload():
+    """
+    Render a short low-resolution preview and a still of an upload right away
+    
+    Takes the same form fields as /upload; only position and extension_ratio
+    shape the preview. The upload is kept, so POST /api/previews/<id>/render
+    queues its full render without uploading it again, and the full render
+    finds the previewed frames' extensions in the extension cache.
+    """
+    if 'file' not in request.files:
+        return jsonify({'error': 'No file part'}), 400
+    
+    file = request.files['file']
+    if file.filename == '' or not allowed_file(file.filename):
+        return jsonify({'error': 'File type not allowed'}), 400
+    
+    try:
+        options, _ = parse_upload_options(request.form)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    results.collect_garbage()
+    filename = secure_filename(file.filename)
+    filepath = os.path.join(app.config['UPLOAD_FOLDER'], f"{uuid.uuid4()}_{filename}")
+    content_hash = save_and_hash(file.stream, filepath)
+    
+    # The same video previewed again keeps using its first upload (and refreshes its expiry)
+    upload_key, upload_ref = preview_upload_ref(content_hash)
+    previous = results.claim(upload_key, upload_ref)
+    if previous is not None:
+        os.remove(filepath)
+        filepath = previous
+    
+    params = {
+        'position': options['position'],
+        'extension_ratio': options['extension_ratio'],
+        'preview_seconds': PREVIEW_SECONDS,
+        'preview_height': PREVIEW_HEIGHT,
+    }
+    video_key = results.result_key(content_hash, {**params, 'preview': 'video'})
+    still_key = results.result_key(content_hash, {**params, 'preview': 'still'})
+    # Stable reference ids: previewing again refreshes the references instead of adding more
+    preview_path = results.claim(video_key, f"preview:{video_key}")
+    still_path = results.claim(still_key, f"preview:{still_key}")
+    
+    cached = preview_path is not None and still_path is not None
+    if not cached:
+        if not preview_slots.acquire(blocking=False):
+            if previous is None:
+                os.remove(filepath)
+            return jsonify({'error': 'Too many previews rendering, try again shortly'}), 503
+        try:
+            preview_path, still_path = processor.render_preview(
+                filepath, options['position'], options['extension_ratio'],
+                seconds=PREVIEW_SECONDS, max_height=PREVIEW_HEIGHT,
+                output_path=output_path_for(filepath, video_key, "_preview"),
+            )
+        except BaseException as e:
+            # A new upload that could not be previewed is not kept
+            if previous is None:
+                os.remove(filepath)
+            if isinstance(e, ValueError):
+                return jsonify({'error': str(e)}), 400
+            raise
+        finally:
+            preview_slots.release()
+        results.add(video_key, content_hash, {**params, 'preview': 'video'}, preview_path, f"preview:{video_key}")
+        results.add(still_key, content_hash, {**params, 'preview': 'still'}, still_path, f"preview:{still_key}")
     
-    return jsonify({'error': 'File type not allowed'}), 400
+    if previous is None:
+        # Another request may have kept the same video in the meantime
+        with preview_lock:
+            previous = results.claim(upload_key, upload_ref)
+            if previous is None:
+                results.add(upload_key, content_hash, {'preview': 'upload'}, filepath, upload_ref)
+        if previous is not None:
+            os.remove(filepath)
+    metrics.increment('previews_cached' if cached else 'previews_rendered')
+    
+    return jsonify({
+        'success': True,
+        'preview_id': content_hash,
+        'preview_video': url_for('serve_output', filename=os.path.relpath(preview_path, OUTPUT_FOLDER)),
+        'preview_still': url_for('serve_output', filename=os.path.relpath(still_path, OUTPUT_FOLDER)),
+        'render_url': url_for('render_preview', preview_id=content_hash),
+        'cached': cached,
+    })
+
+@app.route('/api/previews/<preview_id>/render', methods=['POST'])
+def render_preview(preview_id):
+    """Queue the full render of a previewed upload, with the same options as /upload"""
+    upload_key, upload_ref = preview_upload_ref(preview_id)
+    filepath = results.claim(upload_key, upload_ref)
+    if filepath is None:
+        return jsonify({'error': 'Preview not found'}), 404
+    
+    try:
+        options, params = parse_upload_options(request.form or request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return queue_upload(filepath, preview_id, options, params, keep_upload=True)
+
+def job_response(job):
+    """Status payload for a job, with the output URLs once it has completed"""
+    payload = job.to_dict()
+    if job.status == job.COMPLETED:
+        # Get relative paths for the frontend; a multi-output job lists every output
+        output_paths = job.output_path if isinstance(job.output_path, list) else [job.output_path]
+        output_urls = [
+            url_for('serve_output', filename=os.path.relpath(output_path, OUTPUT_FOLDER))
+            for output_path in output_paths
+        ]
+        payload['output_video'] = output_urls[0]
+        if isinstance(job.output_path, list):
+            payload['output_videos'] = output_urls
+    return payload
+
+@app.route('/api/jobs/<job_id>')
+def job_status(job_id):
+    job = jobs.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify(job_response(job))
+
+@app.route('/api/jobs/<job_id>/result')
+def job_result(job_id):
+    job = jobs.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    if job.status != job.COMPLETED:
+        return jsonify({
+            'error': f'Job is {job.status}',
+            **job_response(job)
+        }), 409
+    return redirect(job_response(job)['output_video'])
+
+@app.route('/api/jobs/<job_id>', methods=['DELETE'])
+def release_job(job_id):
+    """Release the job's hold on its output so it can be garbage-collected"""
+    released = results.release(job_id)
+    if not released and jobs.get(job_id) is None:
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify({'job_id': job_id, 'released': released})
+
+@app.route('/api/jobs/<job_id>/metrics')
+def job_metrics(job_id):
+    """Latency histogram of every pipeline stage of one job"""
+    job = jobs.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify({'job_id': job.id, 'status': job.status, 'stages': job.profiler.to_dict()})
+
+@app.route('/api/jobs/<job_id>/cancel', methods=['POST'])
+def cancel_job(job_id):
+    job = jobs.cancel(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify(job_response(job))
 
 @app.route('/static/<path:filename>')
 def serve_static(filename):
     return send_from_directory(static_dir, filename)
 
+@app.route('/outputs/<path:filename>')
+def serve_output(filename):
+    """
+    Serve a processed video
+    
+    Range requests get 206 partial responses so players can seek, and the
+    ETag is the result's content key, so a re-download of an unchanged output
+    is a 304. The file body goes out through the WSGI server's file wrapper
+    (sendfile under gunicorn) or, with USE_X_SENDFILE, the front-end server.
+    """
+    path = safe_join(OUTPUT_FOLDER, filename)
+    if path is None or not os.path.isfile(path):
+        return jsonify({'error': 'Output not found'}), 404
+    
+    # Outputs not in the result store fall back to Werkzeug's mtime/size ETag
+    etag = results.key_for_output(path) or True
+    return send_file(path, etag=etag, max_age=OUTPUT_MAX_AGE)
+
 @app.route('/api/stats')
 def get_stats():
-    # Count number of videos processed
-    output_files = [f for f in os.listdir(OUTPUT_FOLDER) if os.path.isfile(os.path.join(OUTPUT_FOLDER, f))]
-    
+    # Counted as jobs finish, so no directory scan per request
+    return jsonify({
+        'videos_processed': metrics.counters.get('videos_processed', 0),
+        'extension_cache': processor.ai_extender.cache_stats()
+    })
+
+@app.route('/api/metrics')
+def get_metrics():
+    """Job counters, stage histograms aggregated over finished jobs, and cache stats"""
     return jsonify({
-        'videos_processed': len(output_files)
+        **metrics.snapshot(),
+        'extension_cache': processor.ai_extender.cache_stats(),
     })
 
 if __name__ == '__main__':
@@ -0,0 +1,193 @@
+# Low-overhead timers and counters for the processing pipeline
+import bisect
+import threading
+import time
+
+
+# Pipeline stages every job reports, in pipeline order
+STAGES = ('decode', 'cache_lookup', 'extend', 'interpolate', 'encode', 'finalize')
+
+
+class Histogram:
+    """Latency histogram with fixed buckets, cheap to update and to merge"""
+
+    # Upper bounds in seconds; the last bucket catches everything slower
+    BUCKETS = (
+        0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025,
+        0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, float('inf'),
+    )
+
+    def __init__(self):
+        self.counts = [0] * len(self.BUCKETS)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds):
+        self.counts[bisect.bisect_left(self.BUCKETS, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def merge(self, other):
+        """Add another histogram's observations (a Histogram or its to_dict())"""
+        if isinstance(other, dict):
+            counts = [other['buckets'].get(_bucket_label(bound), 0) for bound in self.BUCKETS]
+            count, total, maximum = other['count'], other['total_seconds'], other['max_seconds']
+        else:
+            counts, count, total, maximum = other.counts, other.count, other.total, other.max
+        for index, bucket_count in enumerate(counts):
+            self.counts[index] += bucket_count
+        self.count += count
+        self.total += total
+        self.max = max(self.max, maximum)
+
+    def percentile(self, fraction):
+        """Upper bound of the bucket holding the given fraction (0-1) of observations"""
+        if not self.count:
+            return None
+        target = fraction * self.count
+        seen = 0
+        for bound, bucket_count in zip(self.BUCKETS, self.counts):
+            seen += bucket_count
+            if seen >= target and bucket_count:
+                # The open-ended bucket is better described by the slowest observation
+                return self.max if bound == float('inf') else min(bound, self.max)
+        return self.max
+
+    def to_dict(self):
+        return {
+            'count': self.count,
+            'total_seconds': self.total,
+            'mean_seconds': self.total / self.count if self.count else None,
+            'max_seconds': self.max,
+            'p50_seconds': self.percentile(0.5),
+            'p95_seconds': self.percentile(0.95),
+            'p99_seconds': self.percentile(0.99),
+            'buckets': {
+                _bucket_label(bound): bucket_count
+                for bound, bucket_count in zip(self.BUCKETS, self.counts) if bucket_count
+            },
+        }
+
+
+def _bucket_label(bound):
+    # JSON has no infinity, so the last bucket is labelled like Prometheus does
+    return '+Inf' if bound == float('inf') else f'{bound:g}'
+
+
+class StageProfiler:
+    """
+    Per-job timings of the pipeline stages
+
+    Stages are timed by the code that runs them with two perf_counter()
+    calls and one observe(); a call may cover several frames (a batch), so
+    each stage also counts the frames it handled. Worker threads may
+    observe concurrently, so parallel extension reports summed worker time.
+    """
+
+    def __init__(self):
+        self.histograms = {}
+        self.frames = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def clock():
+        return time.perf_counter()
+
+    def observe(self, stage, seconds, frames=1):
+        """
+        Record one timed call of a stage
+
+        Args:
+            stage: Stage name (see STAGES)
+            seconds: Time the call took
+            frames: Frames the call handled
+        """
+        with self._lock:
+            histogram = self.histograms.get(stage)
+            if histogram is None:
+                histogram = self.histograms[stage] = Histogram()
+                self.frames[stage] = 0
+            histogram.observe(seconds)
+            self.frames[stage] += frames
+
+    def since(self, stage, start, frames=1):
+        """observe() the time elapsed since a clock() reading"""
+        self.observe(stage, time.perf_counter() - start, frames)
+
+    def merge(self, other):
+        """Add another profiler's timings (a StageProfiler or its to_dict())"""
+        if isinstance(other, StageProfiler):
+            other = other.to_dict()
+        with self._lock:
+            for stage, stats in other.items():
+                histogram = self.histograms.get(stage)
+                if histogram is None:
+                    histogram = self.histograms[stage] = Histogram()
+                    self.frames[stage] = 0
+                histogram.merge(stats)
+                self.frames[stage] += stats['frames']
+
+    def summary(self):
+        """Total and per-frame time of each stage, without the histograms"""
+        with self._lock:
+            return {
+                stage: {
+                    'seconds': histogram.total,
+                    'frames': self.frames[stage],
+                    'ms_per_frame': 1000 * histogram.total / self.frames[stage] if self.frames[stage] else None,
+                }
+                for stage, histogram in self.histograms.items()
+            }
+
+    def to_dict(self):
+        """Full histogram of every stage"""
+        with self._lock:
+            return {
+                stage: dict(histogram.to_dict(), frames=self.frames[stage])
+                for stage, histogram in self.histograms.items()
+            }
+
+
+class MetricsRegistry:
+    """Server-wide counters and stage histograms aggregated over finished jobs"""
+
+    def __init__(self, counters=None):
+        """
+        Args:
+            counters: Initial counter values (e.g. restored totals)
+        """
+        self.counters = dict(counters or {})
+        self.stages = StageProfiler()
+        self.job_seconds = Histogram()
+        self.started_at = time.time()
+        self._lock = threading.Lock()
+
+    def increment(self, name, amount=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def record_job(self, job):
+        """Count a finished job and fold its stage timings into the aggregates"""
+        with self._lock:
+            key = f'jobs_{job.status}'
+            self.counters[key] = self.counters.get(key, 0) + 1
+            if job.status == job.COMPLETED:
+                self.counters['videos_processed'] = self.counters.get('videos_processed', 0) + 1
+                self.counters['frames_processed'] = self.counters.get('frames_processed', 0) + job.frames_done
+                if job.started_at is not None:
+                    self.job_seconds.observe(job.finished_at - job.started_at)
+        self.stages.merge(job.profiler)
+
+    def snapshot(self):
+        with self._lock:
+            counters = dict(self.counters)
+            job_seconds = self.job_seconds.to_dict()
+        return {
+            'uptime_seconds': time.time() - self.started_at,
+            'counters': counters,
+            'job_seconds': job_seconds,
+            'stages': self.stages.to_dict(),
+        }
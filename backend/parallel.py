@@ -0,0 +1,88 @@
+# Runs frame extension on a worker pool while keeping frames in order
+import os
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+
+class ParallelFrameExtender:
+    """Fan frames out to a thread pool and hand them back in frame order"""
+
+    def __init__(self, extender, workers=None, queue_depth=None):
+        """
+        Args:
+            extender: AIImageExtender whose cache and render methods are used
+            workers: Number of worker threads (defaults to the CPU count)
+            queue_depth: Max frames in flight before waiting on the oldest one
+                (defaults to twice the worker count)
+        """
+        self.extender = extender
+        self.workers = workers or os.cpu_count() or 1
+        self.queue_depth = queue_depth or self.workers * 2
+
+    def map(self, frames, position="bottom", extension_ratio=1.0, profiler=None):
+        """
+        Extend an iterable of frames in parallel
+
+        OpenCV and NumPy release the GIL in the heavy parts of the render, so
+        threads scale across cores while still sharing the extension cache.
+
+        Args:
+            frames: Iterable of uint8 frames (BGR or RGB)
+            position: "top" or "bottom" - where to add the extension
+            extension_ratio: How much to extend relative to original height
+            profiler: Optional StageProfiler that receives the cache lookup time
+                and the render and compose time of every worker
+
+        Yields:
+            Extended frames in the same order as the input
+        """
+        in_flight = deque()
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="extend") as pool:
+            for frame in frames:
+                in_flight.append(self._submit(pool, frame, position, extension_ratio, profiler))
+
+                # Bound memory: wait for the oldest frame once the window is full
+                if len(in_flight) >= self.queue_depth:
+                    yield in_flight.popleft().result()
+
+            while in_flight:
+                yield in_flight.popleft().result()
+
+    def _submit(self, pool, frame, position, extension_ratio, profiler=None):
+        """
+        Queue one frame, resolving the cache on the calling thread
+
+        Cache lookups and stores happen here in frame order, exactly as they
+        would in serial mode, so the output is byte-identical to it. A miss
+        stores the pending render's Future, which later frames with the same
+        key share instead of rendering again.
+        """
+        extender = self.extender
+        height, width = frame.shape[:2]
+        extension_height = int(height * extension_ratio)
+
+        start = profiler.clock() if profiler else None
+        cache_key = extender._cache_key(frame, position, width, extension_height)
+        extension = extender._cache_lookup(cache_key)
+        if profiler:
+            profiler.since('cache_lookup', start)
+        if extension is None:
+            extension = pool.submit(
+                self._timed, profiler, 0, extender._render_extension, frame, position, width, extension_height
+            )
+            extender._cache_store(cache_key, extension)
+
+        # Renders are submitted before the compose jobs that wait on them, so
+        # a compose job never blocks a worker that a render still needs
+        return pool.submit(self._timed, profiler, 1, extender._compose, frame, extension, position)
+
+    @staticmethod
+    def _timed(profiler, frames, func, *args):
+        """Run func on a worker, adding its time (and frames) to the profiler's extend stage"""
+        if not profiler:
+            return func(*args)
+        start = profiler.clock()
+        try:
+            return func(*args)
+        finally:
+            profiler.since('extend', start, frames)
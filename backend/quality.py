@@ -0,0 +1,55 @@
+# Image quality metrics for comparing a fast render against a reference
+import cv2
+import numpy as np
+
+
+def psnr(reference, image):
+    """
+    Peak signal-to-noise ratio in dB
+
+    Args:
+        reference: uint8 array
+        image: uint8 array of the same shape
+
+    Returns:
+        PSNR in dB (inf for identical images)
+    """
+    mse = np.mean((reference.astype(np.float64) - image.astype(np.float64)) ** 2)
+    if mse == 0:
+        return float('inf')
+    return float(10 * np.log10(255.0 ** 2 / mse))
+
+
+def ssim(reference, image):
+    """
+    Mean structural similarity of the grayscale images (Gaussian window, sigma 1.5)
+
+    Args:
+        reference: uint8 array of shape (height, width, 3) or (height, width)
+        image: uint8 array of the same shape
+
+    Returns:
+        SSIM between -1 and 1 (1 for identical images)
+    """
+    if reference.ndim == 3:
+        reference = cv2.cvtColor(reference, cv2.COLOR_BGR2GRAY)
+        image = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    x = reference.astype(np.float64)
+    y = image.astype(np.float64)
+
+    c1 = (0.01 * 255) ** 2
+    c2 = (0.03 * 255) ** 2
+
+    def blur(values):
+        return cv2.GaussianBlur(values, (11, 11), 1.5, borderType=cv2.BORDER_REFLECT)
+
+    mu_x = blur(x)
+    mu_y = blur(y)
+    var_x = blur(x * x) - mu_x * mu_x
+    var_y = blur(y * y) - mu_y * mu_y
+    covariance = blur(x * y) - mu_x * mu_y
+
+    ssim_map = ((2 * mu_x * mu_y + c1) * (2 * covariance + c2)) / (
+        (mu_x * mu_x + mu_y * mu_y + c1) * (var_x + var_y + c2)
+    )
+    return float(ssim_map.mean())
@@ -0,0 +1,181 @@
+# Index of finished videos so identical uploads are served without reprocessing
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+
+class ResultStore:
+    """
+    Maps (upload content hash, processing parameters) to a finished output
+
+    Every job or request that hands out an output holds a reference to it.
+    References are released explicitly or expire after ref_ttl seconds, and
+    collect_garbage() deletes outputs that no longer have any.
+    """
+
+    def __init__(self, index_path, ref_ttl=24 * 60 * 60, gc_interval=60):
+        """
+        Args:
+            index_path: sqlite database holding the index
+            ref_ttl: Seconds after which an unreleased reference expires
+            gc_interval: Minimum seconds between two garbage collections
+        """
+        self.index_path = index_path
+        self.ref_ttl = ref_ttl
+        self.gc_interval = gc_interval
+        self._last_gc = 0
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(index_path), exist_ok=True)
+
+        with self._connect() as db:
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS results ("
+                " key TEXT PRIMARY KEY, content_hash TEXT NOT NULL, params TEXT NOT NULL,"
+                " output_path TEXT NOT NULL, created_at REAL NOT NULL)"
+            )
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS refs ("
+                " ref_id TEXT PRIMARY KEY, key TEXT NOT NULL, created_at REAL NOT NULL)"
+            )
+            db.execute("CREATE INDEX IF NOT EXISTS refs_key ON refs (key)")
+            db.execute("CREATE INDEX IF NOT EXISTS results_output ON results (output_path)")
+
+    @staticmethod
+    def result_key(content_hash, params):
+        """Key for an upload processed with params (a JSON-serializable dict)"""
+        canonical = json.dumps(params, sort_keys=True, separators=(',', ':'))
+        return hashlib.sha256(f"{content_hash}:{canonical}".encode()).hexdigest()
+
+    def claim(self, key, ref_id):
+        """
+        Find a finished output and take a reference to it in one transaction,
+        so garbage collection cannot delete it in between
+
+        Returns:
+            The output path, or None if there is none (or its file is gone)
+        """
+        db = self._connect()
+        with db:
+            db.execute("BEGIN IMMEDIATE")
+            row = db.execute("SELECT output_path FROM results WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            if not os.path.exists(row[0]):
+                db.execute("DELETE FROM results WHERE key = ?", (key,))
+                return None
+            db.execute(
+                "INSERT OR REPLACE INTO refs (ref_id, key, created_at) VALUES (?, ?, ?)",
+                (ref_id, key, time.time()),
+            )
+            return row[0]
+
+    def add(self, key, content_hash, params, output_path, ref_id):
+        """
+        Record a finished output together with its first reference
+
+        If the key already has an output on disk (e.g. an identical job
+        finished first), that one stays the stored result. The new output is
+        kept under its own key held only by ref_id, so it is still collected
+        once the reference goes away.
+
+        Args:
+            key: Key from result_key()
+            content_hash: Hash of the uploaded file
+            params: Parameters the output was processed with
+            output_path: The finished video
+            ref_id: Reference (e.g. the job id) that keeps the output alive
+        """
+        db = self._connect()
+        with db:
+            db.execute("BEGIN IMMEDIATE")
+            row = db.execute("SELECT output_path FROM results WHERE key = ?", (key,)).fetchone()
+            if row is not None and row[0] != output_path and os.path.exists(row[0]):
+                key = f"{key}:{ref_id}"
+            db.execute(
+                "INSERT OR REPLACE INTO results (key, content_hash, params, output_path, created_at)"
+                " VALUES (?, ?, ?, ?, ?)",
+                (key, content_hash, json.dumps(params, sort_keys=True), output_path, time.time()),
+            )
+            db.execute(
+                "INSERT OR REPLACE INTO refs (ref_id, key, created_at) VALUES (?, ?, ?)",
+                (ref_id, key, time.time()),
+            )
+
+    def key_for_output(self, output_path):
+        """
+        Key of the result stored at output_path
+
+        The key hashes the upload's content with the processing parameters,
+        so it identifies the output's content (e.g. as an HTTP ETag).
+
+        Returns:
+            The key, or None if output_path is not a stored result
+        """
+        row = self._connect().execute(
+            "SELECT key FROM results WHERE output_path = ?", (output_path,)
+        ).fetchone()
+        return row[0] if row else None
+
+    def release(self, ref_id):
+        """
+        Drop a reference, along with the per-output references ("<ref_id>:<n>")
+        of a job with several outputs
+
+        Returns:
+            True if a reference existed
+        """
+        with self._connect() as db:
+            return db.execute(
+                "DELETE FROM refs WHERE ref_id = ? OR ref_id LIKE ?", (ref_id, f"{ref_id}:%")
+            ).rowcount > 0
+
+    def collect_garbage(self, force=False):
+        """
+        Expire old references and delete outputs nobody references any more
+
+        Runs at most once per gc_interval unless force is set.
+
+        Returns:
+            Number of outputs deleted
+        """
+        now = time.time()
+        if not force and now - self._last_gc < self.gc_interval:
+            return 0
+        self._last_gc = now
+
+        db = self._connect()
+        with db:
+            db.execute("BEGIN IMMEDIATE")
+            db.execute("DELETE FROM refs WHERE created_at < ?", (now - self.ref_ttl,))
+            orphans = db.execute(
+                "SELECT key, output_path FROM results"
+                " WHERE NOT EXISTS (SELECT 1 FROM refs WHERE refs.key = results.key)"
+            ).fetchall()
+            db.executemany("DELETE FROM results WHERE key = ?", [(key,) for key, _ in orphans])
+
+        for _, output_path in orphans:
+            try:
+                os.remove(output_path)
+            except FileNotFoundError:
+                pass
+        if orphans:
+            print(f"Removed {len(orphans)} unreferenced outputs")
+        return len(orphans)
+
+    def stats(self):
+        db = self._connect()
+        results = db.execute("SELECT COUNT(*) FROM results").fetchone()[0]
+        refs = db.execute("SELECT COUNT(*) FROM refs").fetchone()[0]
+        return {'results': results, 'refs': refs}
+
+    def _connect(self):
+        """sqlite connection for the calling thread"""
+        db = getattr(self._local, "db", None)
+        if db is None:
+            db = sqlite3.connect(self.index_path, timeout=30)
+            db.execute("PRAGMA journal_mode=WAL")
+            self._local.db = db
+        return db
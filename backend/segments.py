@@ -0,0 +1,344 @@
+# Splits one long video into GOP-aligned segments processed in parallel processes
+import multiprocessing
+import os
+import re
+import shutil
+import subprocess
+import tempfile
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+import cv2
+from encoders import concat_videos, ffmpeg_available
+from jobs import JobCancelled
+from metrics import StageProfiler
+
+
+def keyframe_indices(video_path, fps):
+    """
+    Frame indices of the keyframes of a video's first video stream
+
+    Only keyframes are decoded (ffmpeg -skip_frame nokey), so this is fast
+    even for long videos.
+
+    Args:
+        video_path: Video to probe
+        fps: Frame rate used to turn keyframe timestamps into indices
+
+    Returns:
+        Sorted list of frame indices, always starting with 0
+    """
+    ffmpeg_path = ffmpeg_available()
+    if ffmpeg_path is None or not fps:
+        return [0]
+
+    result = subprocess.run(
+        [ffmpeg_path, '-hide_banner', '-nostats', '-skip_frame', 'nokey', '-i', video_path,
+         '-map', '0:v:0', '-an', '-vf', 'showinfo', '-f', 'null', '-'],
+        stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+    )
+    times = [float(match) for match in re.findall(rb'pts_time:\s*(-?[0-9.]+)', result.stderr)]
+    if not times:
+        return [0]
+
+    start = times[0]
+    return sorted({0} | {int(round((time - start) * fps)) for time in times})
+
+
+def plan_segments(frame_count, keyframes, segments, min_frames):
+    """
+    Split [0, frame_count) into up to `segments` ranges that start on keyframes
+
+    Args:
+        frame_count: Frames in the video
+        keyframes: Sorted keyframe indices
+        segments: Number of ranges wanted
+        min_frames: Shortest range worth its own process
+
+    Returns:
+        List of (start_frame, end_frame) pairs covering the whole video
+    """
+    segments = max(min(segments, frame_count // max(min_frames, 1)), 1)
+    starts = [0]
+    for index in range(1, segments):
+        # Cut at the keyframe closest to an even split that leaves both sides long enough
+        ideal = index * frame_count / segments
+        candidates = [
+            keyframe for keyframe in keyframes
+            if keyframe - starts[-1] >= max(min_frames, 1) and frame_count - keyframe >= min_frames
+        ]
+        if candidates:
+            starts.append(min(candidates, key=lambda keyframe: abs(keyframe - ideal)))
+    return list(zip(starts, starts[1:] + [frame_count]))
+
+
+class SegmentProgress:
+    """
+    Stands in for the ProcessingJob inside a segment worker process
+
+    The shared dict and event live in the manager process, so every access
+    is a round trip; progress is sent and cancellation checked at most once
+    per REPORT_INTERVAL (stats changes and flush() are sent right away).
+    """
+
+    REPORT_INTERVAL = 0.5
+
+    def __init__(self, index, progress, cancel_event):
+        """
+        Args:
+            index: Segment number
+            progress: Shared dict receiving (frames_done, stats) per segment
+            cancel_event: Shared event set when the job is cancelled
+        """
+        self.index = index
+        self.progress = progress
+        self.cancel_event = cancel_event
+        self.frames_done = 0
+        self.stats = {}
+        self.profiler = StageProfiler()
+        self._reported_at = 0.0
+        self._checked_at = 0.0
+
+    def update(self, frames_done=None, frames_total=None, **stats):
+        if frames_done is not None:
+            self.frames_done = frames_done
+        self.stats.update(stats)
+        if stats or time.monotonic() - self._reported_at >= self.REPORT_INTERVAL:
+            self.flush()
+
+    def flush(self):
+        """Send the current progress to the parent process"""
+        self._reported_at = time.monotonic()
+        self.progress[self.index] = (self.frames_done, self.stats)
+
+    def check_cancelled(self):
+        now = time.monotonic()
+        if now - self._checked_at < self.REPORT_INTERVAL:
+            return
+        self._checked_at = now
+        if self.cancel_event.is_set():
+            raise JobCancelled(f"Segment {self.index} was cancelled")
+
+
+# The VideoProcessor of a segment worker process, built on its first segment
+_worker_processor = None
+
+
+def _build_cache(max_entries, max_bytes, tolerance, disk_directory=None, disk_max_bytes=None):
+    """Extension cache of a worker process, sharing the server's disk tier if it has one"""
+    from disk_cache import DiskExtensionCache
+    from extension_cache import ExtensionCache
+    disk = None
+    if disk_directory is not None:
+        disk = DiskExtensionCache(disk_directory, disk_max_bytes)
+    return ExtensionCache(max_entries, max_bytes, tolerance, disk)
+
+
+def _process_segment(settings, index, video_path, output_path, start_frame, end_frame, options,
+                     progress, cancel_event):
+    """Process one segment inside a worker process, returning its stage timings"""
+    global _worker_processor
+    if _worker_processor is None:
+        from video_processing import VideoProcessor
+        settings = dict(settings)
+        settings['extension_cache'] = _build_cache(**settings.pop('cache_settings'))
+        _worker_processor = VideoProcessor(**settings)
+
+    job = SegmentProgress(index, progress, cancel_event)
+    _worker_processor.process_video(
+        video_path, start_frame=start_frame, end_frame=end_frame, output_path=output_path, job=job, **options
+    )
+    job.flush()
+    return job.profiler.to_dict()
+
+
+class SegmentedVideoProcessor:
+    """
+    Processes a long video as independent GOP-aligned segments on a process pool
+
+    Each segment is seeked to, decoded, extended and encoded by its own worker
+    process, then the encoded segments are joined with ffmpeg's concat demuxer
+    (stream copy, no re-encode). A failed segment is retried on its own.
+    Videos too short to split, or servers without ffmpeg, fall back to the
+    processor's sequential path.
+    """
+
+    def __init__(self, processor, processes=None, min_segment_seconds=20, retries=2):
+        """
+        Args:
+            processor: VideoProcessor whose settings the workers copy
+            processes: Worker processes (defaults to the CPU count)
+            min_segment_seconds: Shortest segment worth its own process
+            retries: Extra attempts for a segment that fails
+        """
+        self.processor = processor
+        self.processes = processes or os.cpu_count() or 1
+        self.min_segment_seconds = min_segment_seconds
+        self.retries = retries
+        self._pool = None
+        # Workers are spawned, never forked from the threaded server process
+        self._context = multiprocessing.get_context('spawn')
+
+    def process_video(self, video_path, position="bottom", extension_ratio=1.0, fps=None, sample_rate=1, job=None,
+                      encoder_options=None, reuse_threshold=0.0, output_path=None):
+        """
+        Process a video across the worker processes
+
+        Takes the same options as VideoProcessor.process_video.
+
+        Returns:
+            Path to the processed video
+        """
+        options = {
+            'position': position,
+            'extension_ratio': extension_ratio,
+            'fps': fps,
+            'sample_rate': sample_rate,
+            'encoder_options': encoder_options,
+            'reuse_threshold': reuse_threshold,
+        }
+
+        cap = cv2.VideoCapture(video_path)
+        if not cap.isOpened():
+            raise ValueError(f"Could not open video file: {video_path}")
+        input_fps = cap.get(cv2.CAP_PROP_FPS)
+        frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        cap.release()
+
+        segments = []
+        if self.processes > 1 and ffmpeg_available():
+            keyframes = keyframe_indices(video_path, input_fps)
+            min_frames = int(self.min_segment_seconds * input_fps)
+            segments = plan_segments(frame_count, keyframes, self.processes, min_frames)
+        if len(segments) < 2:
+            return self.processor.process_video(video_path, job=job, output_path=output_path, **options)
+
+        print(f"Processing video with {frame_count} frames as {len(segments)} segments...")
+        if job:
+            job.update(frames_total=frame_count, segments=len(segments))
+        # Only the joined file is served, so only its index is moved to the front
+        faststart = {**self.processor.encoder_options, **(encoder_options or {})}.get('faststart', True)
+        options['encoder_options'] = {**(encoder_options or {}), 'faststart': False}
+
+        output_path = output_path or self.processor._output_path_for(video_path)
+        _, ext = os.path.splitext(output_path)
+        work_dir = tempfile.mkdtemp(prefix='.segments-', dir=self.processor.output_path)
+        segment_paths = [os.path.join(work_dir, f"segment_{index:04d}{ext}") for index in range(len(segments))]
+
+        manager = self._context.Manager()
+        try:
+            progress = manager.dict()
+            cancel_event = manager.Event()
+            self._run_segments(
+                video_path, segments, segment_paths, options, progress, cancel_event, job
+            )
+            start = StageProfiler.clock()
+            concat_videos(segment_paths, output_path, faststart)
+            if job:
+                job.profiler.since('finalize', start, 0)
+                job.update(frames_done=frame_count, **self._merge_stats(progress, len(segments)))
+        finally:
+            manager.shutdown()
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+        print(f"Video saved to {output_path}")
+        return output_path
+
+    def _run_segments(self, video_path, segments, segment_paths, options, progress, cancel_event, job):
+        """Run every segment to completion, retrying failed ones"""
+        settings = self._worker_settings()
+        attempts = [0] * len(segments)
+        futures = {}
+
+        def submit(index):
+            attempts[index] += 1
+            start_frame, end_frame = segments[index]
+            if index == len(segments) - 1:
+                # The frame count is only an estimate: the last segment reads to the end
+                end_frame = None
+            future = self._get_pool().submit(
+                _process_segment, settings, index, video_path, segment_paths[index],
+                start_frame, end_frame, options, progress, cancel_event
+            )
+            futures[future] = index
+
+        for index in range(len(segments)):
+            submit(index)
+
+        try:
+            while futures:
+                done, _ = wait(futures, timeout=0.5, return_when=FIRST_COMPLETED)
+                if job:
+                    job.update(frames_done=sum(frames_done for frames_done, _ in progress.values()))
+                    job.check_cancelled()
+
+                for future in done:
+                    index = futures.pop(future)
+                    error = future.exception()
+                    if error is None:
+                        if job:
+                            job.profiler.merge(future.result())
+                        continue
+                    if isinstance(error, JobCancelled):
+                        raise error
+                    if isinstance(error, BrokenProcessPool):
+                        # A worker died; later submissions get a fresh pool
+                        self._pool = None
+                    if attempts[index] > self.retries:
+                        raise RuntimeError(f"Segment {index} failed after {attempts[index]} attempts: {error}")
+                    print(f"Segment {index} failed ({error}), retrying...")
+                    progress.pop(index, None)
+                    submit(index)
+        except BaseException:
+            # Stop the other segments before giving up
+            cancel_event.set()
+            for future in futures:
+                future.cancel()
+            wait(futures)
+            raise
+
+    @staticmethod
+    def _merge_stats(progress, segment_count):
+        """Combine the job stats the segments reported"""
+        segment_stats = [progress.get(index, (0, {}))[1] for index in range(segment_count)]
+        stats = {}
+        if any('reused_frames' in segment for segment in segment_stats):
+            frames = sum(progress.get(index, (0, {}))[0] for index in range(segment_count))
+            reused = sum(segment.get('reused_frames', 0) for segment in segment_stats)
+            stats['reused_frames'] = reused
+            stats['reuse_rate'] = reused / frames if frames else 0.0
+        if 'extension_quality' in segment_stats[0]:
+            stats['extension_quality'] = segment_stats[0]['extension_quality']
+        return stats
+
+    def _worker_settings(self):
+        """VideoProcessor arguments that reproduce the processor in a worker"""
+        processor = self.processor
+        cache = processor.ai_extender.extension_cache
+        settings = {
+            'output_path': processor.output_path,
+            'batch_size': processor.batch_size,
+            'encoder_options': processor.encoder_options,
+            'extension_scale': processor.ai_extender.scale,
+            'cache_settings': {
+                'max_entries': cache.max_entries,
+                'max_bytes': cache.max_bytes,
+                'tolerance': cache.tolerance,
+            },
+        }
+        if cache.disk is not None:
+            # Workers share the persistent tier with the server
+            settings['cache_settings']['disk_directory'] = cache.disk.directory
+            settings['cache_settings']['disk_max_bytes'] = cache.disk.max_bytes
+        return settings
+
+    def _get_pool(self):
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(max_workers=self.processes, mp_context=self._context)
+        return self._pool
+
+    def shutdown(self):
+        """Stop the worker processes"""
+        if self._pool is not None:
+            self._pool.shutdown(cancel_futures=True)
+            self._pool = None
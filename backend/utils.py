@@ -1 +1,25 @@
-# Helper functions (resizing, padding, etc.)
\ No newline at end of file
+# Helper functions (resizing, padding, etc.)
+import hashlib
+
+
+def save_and_hash(stream, path, chunk_size=1024 * 1024):
+    """
+    Copy a file-like stream to path in chunks, hashing it on the way
+
+    Args:
+        stream: Readable binary file-like object (e.g. an upload's stream)
+        path: Destination file
+        chunk_size: Bytes read per chunk
+
+    Returns:
+        Hex SHA-256 digest of the content
+    """
+    digest = hashlib.sha256()
+    with open(path, 'wb') as f:
+        while True:
+            chunk = stream.read(chunk_size)
+            if not chunk:
+                break
+            digest.update(chunk)
+            f.write(chunk)
+    return digest.hexdigest()
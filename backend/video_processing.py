@@ -2,25 +2,57 @@
 # Handles conversion: frame extraction, AI enhancement, merging
 import os
 import cv2
-import tempfile
 import numpy as np
-from PIL import Image
 import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait
 from pathlib import Path
 from ai_extender import AIImageExtender
+from parallel import ParallelFrameExtender
+from encoders import open_video_writer, output_extension
+from interpolation import KeyframeInterpolator
+from keyframe_scheduler import KeyframeScheduler, edge_thumbnail, thumbnail_difference
 
 class VideoProcessor:
     """Class to process videos for vertical enhancement"""
     
-    def __init__(self, output_path="static/output", api_key=None):
-        """Initialize with output path and optional API key"""
+    # Longest run of frames that may reuse one extension before it is regenerated
+    MAX_REUSED_FRAMES = 24
+    
+    # Progress is logged once every this many frames (job status has the exact count)
+    LOG_INTERVAL = 100
+    
+    # Previews trade quality for speed; they are watched once, at a small size
+    PREVIEW_ENCODER_OPTIONS = {'preset': 'ultrafast', 'crf': 30}
+    
+    def __init__(self, output_path="static/output", api_key=None, workers=1, queue_depth=None,
+                 encoder_options=None, extension_cache=None, batch_size=1, extension_scale=1.0):
+        """
+        Initialize with output path and optional API key
+        
+        Args:
+            output_path: Directory for processed videos
+            api_key: Unused, kept for compatibility
+            workers: Threads used to extend frames (1 processes frames serially)
+            queue_depth: Max frames in flight in parallel mode (defaults to 2 x workers)
+            encoder_options: Default encoder settings (preset, crf, threads) for every job
+            extension_cache: ExtensionCache shared by all jobs (a default one is created if None)
+            batch_size: Frames extended per call in serial mode
+            extension_scale: Resolution (0-1] extensions are generated at before upsampling
+        """
         self.output_path = output_path
-        self.ai_extender = AIImageExtender() # No API key needed now
+        self.ai_extender = AIImageExtender(extension_cache, extension_scale) # No API key needed now
+        self.workers = workers
+        self.queue_depth = queue_depth
+        self.batch_size = max(int(batch_size), 1)
+        self.encoder_options = encoder_options or {}
         
         # Ensure the output directory exists
         os.makedirs(output_path, exist_ok=True)
     
-    def process_video(self, video_path, position="bottom", extension_ratio=1.0, fps=None, sample_rate=1):
+    def process_video(self, video_path, position="bottom", extension_ratio=1.0, fps=None, sample_rate=1, job=None,
+                      encoder_options=None, reuse_threshold=0.0, start_frame=0, end_frame=None, output_path=None,
+                      capture=None):
         """
         Process a video by extracting frames, extending them, and rebuilding
         
@@ -29,13 +61,26 @@ class VideoProcessor:
             position: "top" or "bottom" - where to add the extension
             extension_ratio: How much to extend relative to original height
             fps: Frames per second for output (uses input fps if None)
-            sample_rate: Process 1 out of every N frames (for speed)
+            sample_rate: Generate an extension for 1 out of every N frames (for speed);
+                the frames in between get the nearest generated extension. At most
+                MAX_REUSED_FRAMES, since the frames in between wait in memory until
+                the next generated frame is extended
+            job: Optional ProcessingJob that receives progress and can cancel the run
+            encoder_options: Encoder settings for this job (preset, crf, threads)
+            reuse_threshold: Mean edge difference (0-255) under which a frame reuses
+                the last generated extension instead of getting its own (0 = off)
+            start_frame: First frame to process (the capture seeks to it)
+            end_frame: Frame to stop before (None for the end of the video)
+            output_path: Where to write the result (defaults to a name in the output directory)
+            capture: Already opened capture to read instead of video_path (e.g. a
+                StreamingCapture of an upload still arriving; its frame count may be 0
+                until the end)
         
         Returns:
             Path to the processed video
         """
         # Get video properties
-        cap = cv2.VideoCapture(video_path)
+        cap = capture if capture is not None else cv2.VideoCapture(video_path)
         if not cap.isOpened():
             raise ValueError(f"Could not open video file: {video_path}")
         
@@ -51,78 +96,541 @@ class VideoProcessor:
         extension_height = int(height * extension_ratio)
         new_height = height + extension_height
         
-        # Create temporary directory for frames
-        with tempfile.TemporaryDirectory() as temp_dir:
-            # Extract and process frames
-            processed_frames = []
+        # Only a range of the video: seek to its start and stop at its end
+        if start_frame > 0:
+            cap.set(cv2.CAP_PROP_POS_FRAMES, start_frame)
+        frame_count = min(end_frame if end_frame is not None else frame_count, frame_count) - start_frame
+        
+        # Create output video name
+        output_path = output_path or self._output_path_for(video_path)
+        
+        # Frames between two samples are held until the next sample is extended
+        sample_rate = min(max(int(sample_rate), 1), self.MAX_REUSED_FRAMES)
+        print(f"Processing video with {frame_count} frames, extending every {sample_rate} frames...")
+        profiler = job.profiler if job else None
+        if job:
+            job.update(frames_total=frame_count)
+        
+        # Stream decode -> extend -> encode so only a handful of frames are alive at once.
+        # Every frame is still decoded and written; sampling only skips extensions
+        frames = self._read_frames(cap, limit=frame_count if end_frame is not None else None, profiler=profiler)
+        frames = self._probe_quality(frames, position, extension_ratio, job)
+        sparse = sample_rate > 1 or reuse_threshold > 0
+        if sparse:
+            reuse_stats = {'reused': 0, 'frames': 0}
+            extended_frames = self._extend_with_reuse(
+                frames, frame_count, position, extension_ratio, sample_rate, reuse_threshold, reuse_stats,
+                profiler
+            )
+        else:
+            extended_frames = self._extend_frames(frames, frame_count, position, extension_ratio, profiler=profiler)
+        
+        # Create the output video
+        self._frames_to_video(
+            extended_frames, output_path, fps, (width, new_height), job, encoder_options, profiler
+        )
+        
+        if job and frame_count <= 0:
+            # A streamed upload's length is only known once it has been decoded
+            job.update(frames_total=job.frames_done)
+        
+        if sparse:
+            reuse_rate = reuse_stats['reused'] / reuse_stats['frames'] if reuse_stats['frames'] else 0.0
+            print(f"Reused extensions for {reuse_stats['reused']}/{reuse_stats['frames']} frames")
+            if job:
+                job.update(reused_frames=reuse_stats['reused'], reuse_rate=reuse_rate)
+        
+        return output_path
+    
+    def process_video_multi(self, video_path, outputs, fps=None, job=None, encoder_options=None, capture=None,
+                            output_paths=None):
+        """
+        Render several outputs (positions / extension ratios) of a video from one decode
+        
+        Every frame is decoded once and extended for all outputs in the same
+        batch, so the outputs share the edge analysis and the extension cache.
+        Each output has its own encoder, fed on its own thread while the next
+        batch is being extended.
+        
+        Args:
+            video_path: Path to the input video
+            outputs: List of dicts with the 'position' and 'extension_ratio' of each output
+            fps: Frames per second for the outputs (uses input fps if None)
+            job: Optional ProcessingJob that receives progress and can cancel the run
+            encoder_options: Encoder settings for this job (preset, crf, threads)
+            capture: Already opened capture to read instead of video_path (see process_video)
+            output_paths: Where to write each output (defaults to names in the output directory)
+        
+        Returns:
+            List of paths to the processed videos, in the order of outputs
+        """
+        variants = [(output['position'], output['extension_ratio']) for output in outputs]
+        if not variants:
+            raise ValueError("At least one output is required")
+        if len(set(variants)) != len(variants):
+            raise ValueError("Outputs must not repeat a position and extension ratio")
+        
+        cap = capture if capture is not None else cv2.VideoCapture(video_path)
+        if not cap.isOpened():
+            raise ValueError(f"Could not open video file: {video_path}")
+        
+        width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+        height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+        fps = fps or cap.get(cv2.CAP_PROP_FPS)
+        frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        
+        output_paths = output_paths or [
+            self._output_path_for(video_path, f"_vertical_{position}_{extension_ratio:g}")
+            for position, extension_ratio in variants
+        ]
+        
+        print(f"Processing video with {frame_count} frames into {len(variants)} outputs...")
+        profiler = job.profiler if job else None
+        if job:
+            job.update(frames_total=frame_count, outputs=len(variants))
+        
+        options = {**self.encoder_options, **(encoder_options or {})}
+        writers = []
+        
+        def encode(writer, frames):
+            start = profiler.clock() if profiler else None
+            for frame in frames:
+                writer.write(frame)
+            if profiler:
+                profiler.since('encode', start, len(frames))
+        
+        frames_done = 0
+        # Writes of the previous batch, still running while the next one is extended
+        in_flight = []
+        with ThreadPoolExecutor(max_workers=len(variants), thread_name_prefix="encode") as pool:
+            try:
+                for position, extension_ratio in variants:
+                    dimensions = (width, height + int(height * extension_ratio))
+                    writers.append(open_video_writer(output_paths[len(writers)], fps, dimensions, options))
+                
+                batch = None
+                count = 0
+                frames = self._read_frames(cap, profiler=profiler)
+                while True:
+                    frame_idx, frame = next(frames, (None, None))
+                    if frame is not None:
+                        if batch is None:
+                            batch = np.empty((self.batch_size,) + frame.shape, dtype=np.uint8)
+                        batch[count] = frame
+                        count += 1
+                        if frame_idx % self.LOG_INTERVAL == 0:
+                            print(f"Processing frame {frame_idx}/{frame_count}")
+                        if count < self.batch_size:
+                            continue
+                    if count:
+                        start = profiler.clock() if profiler else None
+                        # Fresh output arrays per batch, so the encoders can still be reading the last ones
+                        extended = self.ai_extender.extend_variants(batch[:count], variants, profiler=profiler)
+                        if profiler:
+                            profiler.since('extend', start, count)
+                        
+                        for future in in_flight:
+                            future.result()
+                        in_flight = [pool.submit(encode, writer, frames_out)
+                                     for writer, frames_out in zip(writers, extended)]
+                        frames_done += count
+                        count = 0
+                        if job:
+                            job.update(frames_done=frames_done)
+                            job.check_cancelled()
+                    if frame is None:
+                        break
+                
+                for future in in_flight:
+                    future.result()
+                
+                start = profiler.clock() if profiler else None
+                # Every encoder finishes its file at the same time
+                for future in [pool.submit(writer.release) for writer in writers]:
+                    future.result()
+                if profiler:
+                    profiler.since('finalize', start, 0)
+            except BaseException:
+                # Don't leave truncated videos behind
+                for future in in_flight:
+                    future.cancel()
+                wait(in_flight)
+                for writer, output_path in zip(writers, output_paths):
+                    writer.abort()
+                    if os.path.exists(output_path):
+                        os.remove(output_path)
+                cap.release()
+                raise
+        
+        if job and frame_count <= 0:
+            # A streamed upload's length is only known once it has been decoded
+            job.update(frames_total=frames_done)
+        
+        for output_path in output_paths:
+            print(f"Video saved to {output_path}")
+        return output_paths
+    
+    def render_preview(self, video_path, position="bottom", extension_ratio=1.0, seconds=3.0, clips=3,
+                       max_height=360, encoder_options=None, output_path=None):
+        """
+        Render a short, low-resolution preview of a video and a full-resolution still
+        
+        The preview is a few seconds of frames taken as clips spread across the
+        video. Its frames are extended at full resolution through the shared
+        extension cache, so a full render of the same video reuses them, and
+        only then downscaled and encoded with a fast preset.
+        
+        Args:
+            video_path: Path to the input video
+            position: "top" or "bottom" - where to add the extension
+            extension_ratio: How much to extend relative to original height
+            seconds: Length of the preview
+            clips: Number of excerpts the preview is made of
+            max_height: Height of the preview video (never upscaled)
+            encoder_options: Overrides of PREVIEW_ENCODER_OPTIONS
+            output_path: Where to write the preview (defaults to a name in the output
+                directory); the still is written next to it with a .jpg extension
+        
+        Returns:
+            (preview_path, still_path): the preview video and a JPEG of an extended frame
+        """
+        cap = cv2.VideoCapture(video_path)
+        if not cap.isOpened():
+            raise ValueError(f"Could not open video file: {video_path}")
+        
+        width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+        height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+        fps = cap.get(cv2.CAP_PROP_FPS) or 24
+        frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        new_height = height + int(height * extension_ratio)
+        
+        # Evenly spaced clips, or the start of the video when it is barely longer than the preview
+        preview_frames = max(int(seconds * fps), 1)
+        clip_frames = max(preview_frames // clips, 1)
+        if clips > 1 and frame_count > preview_frames:
+            starts = [index * (frame_count - clip_frames) // (clips - 1) for index in range(clips)]
+        else:
+            starts, clip_frames = [0], preview_frames
+        still_idx = (len(starts) // 2) * clip_frames + clip_frames // 2
+        
+        # Even dimensions, so the encoder never has to pad
+        scale = min(max_height / new_height, 1.0)
+        dimensions = (max(2 * round(width * scale / 2), 2), max(2 * round(new_height * scale / 2), 2))
+        
+        preview_path = output_path or self._output_path_for(video_path, f"_preview_{position}_{extension_ratio:g}")
+        still_path = os.path.splitext(preview_path)[0] + ".jpg"
+        
+        def excerpt():
+            for start in starts:
+                if start != int(cap.get(cv2.CAP_PROP_POS_FRAMES)):
+                    cap.set(cv2.CAP_PROP_POS_FRAMES, start)
+                for _ in range(clip_frames):
+                    ret, frame = cap.read()
+                    if not ret:
+                        return
+                    yield frame
+        
+        video_writer = open_video_writer(
+            preview_path, fps, dimensions,
+            {**self.encoder_options, **self.PREVIEW_ENCODER_OPTIONS, **(encoder_options or {})}
+        )
+        still = None
+        try:
+            extended_frames = self._extend_batches(excerpt(), position, extension_ratio, self.batch_size)
+            for frame_idx, extended in enumerate(extended_frames):
+                if frame_idx <= still_idx:
+                    still = extended
+                video_writer.write(cv2.resize(extended, dimensions, interpolation=cv2.INTER_AREA))
+            if still is None:
+                raise ValueError(f"Could not read any frames from {video_path}")
+            video_writer.release()
+        except BaseException:
+            video_writer.abort()
+            if os.path.exists(preview_path):
+                os.remove(preview_path)
+            raise
+        finally:
+            cap.release()
+        
+        cv2.imwrite(still_path, still, [cv2.IMWRITE_JPEG_QUALITY, 90])
+        print(f"Preview saved to {preview_path}")
+        return preview_path, still_path
+    
+    def _output_path_for(self, video_path, suffix="_vertical"):
+        """Build the output path for a processed copy of video_path"""
+        input_filename = os.path.basename(video_path)
+        name, _ = os.path.splitext(input_filename)
+        output_filename = f"{name}{suffix}{output_extension(video_path)}"
+        return os.path.join(self.output_path, output_filename)
+    
+    def _read_frames(self, cap, next_buffer=None, limit=None, profiler=None):
+        """
+        Decode frames lazily from an opened capture
+        
+        Args:
+            cap: Opened cv2.VideoCapture
+            next_buffer: Optional callable returning a (height, width, 3) uint8
+                array (or contiguous view) to decode the next frame into
+            limit: Optional maximum number of frames to read
+            profiler: Optional StageProfiler that receives the decode time
+        
+        Yields:
+            (frame_idx, frame) tuples with BGR uint8 frames; the capture is
+            released once the generator is exhausted or closed
+        """
+        try:
             frame_idx = 0
-            
-            print(f"Processing video with {frame_count} frames, sampling every {sample_rate} frames...")
-            
-            while True:
-                ret, frame = cap.read()
+            while limit is None or frame_idx < limit:
+                start = profiler.clock() if profiler else None
+                ret, frame = cap.read(next_buffer() if next_buffer else None)
                 if not ret:
                     break
-                
-                # Only process every Nth frame based on sample_rate
-                if frame_idx % sample_rate == 0:
-                    print(f"Processing frame {frame_idx}/{frame_count}")
-                    
-                    # Convert OpenCV BGR to PIL RGB format
-                    pil_frame = Image.fromarray(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB))
-                    
-                    # Extend the frame
-                    extended_frame = self.ai_extender.extend_frame(
-                        pil_frame, position, extension_ratio
-                    )
-                    
-                    # Save the processed frame path
-                    frame_path = os.path.join(temp_dir, f"frame_{frame_idx:06d}.jpg")
-                    extended_frame.save(frame_path)
-                    processed_frames.append(frame_path)
-                
+                if profiler:
+                    profiler.since('decode', start)
+                yield frame_idx, frame
                 frame_idx += 1
-            
+        finally:
             cap.release()
-            
-            # Create output video name
-            input_filename = os.path.basename(video_path)
-            name, ext = os.path.splitext(input_filename)
-            output_filename = f"{name}_vertical{ext}"
-            output_path = os.path.join(self.output_path, output_filename)
-            
-            # Create the output video
-            self._frames_to_video(processed_frames, output_path, fps, (width, new_height))
-            
-            return output_path
     
-    def _frames_to_video(self, frame_paths, output_path, fps, dimensions):
-        """Convert a series of frames to a video"""
-        width, height = dimensions
-        fourcc = cv2.VideoWriter_fourcc(*'mp4v')  # or 'XVID', 'H264', etc.
-        video_writer = cv2.VideoWriter(output_path, fourcc, fps, (width, height))
-        
-        for frame_path in frame_paths:
-            # Read the image
-            img = cv2.imread(frame_path)
+    def _probe_quality(self, frames, position, extension_ratio, job):
+        """
+        Pass (frame_idx, frame) pairs through, reporting on the first frame how
+        far the extender's reduced render scale is from a full-resolution render
+        """
+        for frame_idx, frame in frames:
+            if frame_idx == 0 and job and self.ai_extender.scale < 1:
+                quality = self.ai_extender.measure_quality(frame, position, extension_ratio)
+                # JSON has no infinity, so an exact match reports a PSNR of None
+                job.update(extension_quality={
+                    key: None if value == float('inf') else value for key, value in quality.items()
+                })
+            yield frame_idx, frame
+    
+    def _extend_frames(self, frames, frame_count, position, extension_ratio, queue_depth=None, batch_size=None,
+                       profiler=None):
+        """
+        Extend (frame_idx, frame) pairs as they arrive
+        
+        Args:
+            frames: Iterable of (frame_idx, frame) pairs
+            frame_count: Total frame count, for progress output
+            position: "top" or "bottom" - where to add the extension
+            extension_ratio: How much to extend relative to original height
+            queue_depth: Overrides the processor's in-flight limit in parallel mode
+            batch_size: Overrides the processor's batch size in serial mode
+            profiler: Optional StageProfiler that receives the extension and cache lookup times
+        
+        Yields:
+            Extended BGR frames in input order
+        """
+        def announced():
+            for frame_idx, frame in frames:
+                if frame_idx % self.LOG_INTERVAL == 0:
+                    print(f"Processing frame {frame_idx}/{frame_count}")
+                yield frame
+        
+        if self.workers > 1:
+            # Fan frames out to the worker pool; results come back in frame order
+            pool = ParallelFrameExtender(self.ai_extender, self.workers, queue_depth or self.queue_depth)
+            yield from pool.map(announced(), position, extension_ratio, profiler)
+        else:
+            yield from self._extend_batches(
+                announced(), position, extension_ratio, batch_size or self.batch_size, profiler
+            )
+    
+    def _extend_batches(self, frames, position, extension_ratio, batch_size, profiler=None):
+        """
+        Extend frames batch_size at a time through the extender's batched path
+        
+        Decoded frames are copied into one reusable input buffer, so each batch
+        costs a single output allocation. Yielded frames are views into that
+        batch's output and stay valid after later batches are rendered.
+        
+        Yields:
+            Extended BGR frames in input order
+        """
+        def extend(batch):
+            start = profiler.clock() if profiler else None
+            extended = self.ai_extender.extend_batch(batch, position, extension_ratio, profiler=profiler)
+            if profiler:
+                profiler.since('extend', start, len(batch))
+            return extended
+        
+        if batch_size == 1:
+            for frame in frames:
+                # Extend the frame (the extender works on BGR arrays directly)
+                start = profiler.clock() if profiler else None
+                extended = self.ai_extender.extend_array(frame, position, extension_ratio, profiler)
+                if profiler:
+                    profiler.since('extend', start)
+                yield extended
+            return
+        
+        batch = None
+        count = 0
+        for frame in frames:
+            if batch is None or batch.shape[1:] != frame.shape:
+                if count:
+                    yield from extend(batch[:count])
+                    count = 0
+                batch = np.empty((batch_size,) + frame.shape, dtype=np.uint8)
             
-            # Write to video
-            video_writer.write(img)
+            batch[count] = frame
+            count += 1
+            if count == batch_size:
+                yield from extend(batch)
+                count = 0
         
-        video_writer.release()
-        print(f"Video saved to {output_path}")
+        if count:
+            yield from extend(batch[:count])
+    
+    def _extend_with_reuse(self, frames, frame_count, position, extension_ratio, sample_rate, reuse_threshold,
+                           stats, profiler=None):
+        """
+        Extend frames, generating extensions only where they are needed
+        
+        Only every sample_rate-th frame is a candidate for its own extension.
+        With a reuse_threshold, a candidate whose edge rows are within the
+        threshold of the last generated frame's is skipped too (but never more
+        than MAX_REUSED_FRAMES frames in a row). Skipped frames are composed
+        with the extension of the nearest generated frame, or the previous
+        one for frames skipped because their edge did not change.
+        
+        Args:
+            frames: Iterable of (frame_idx, frame) pairs
+            frame_count: Total frame count, for progress output
+            position: "top" or "bottom" - where to add the extension
+            extension_ratio: How much to extend relative to original height
+            sample_rate: Generate an extension for at most 1 out of every N frames
+            reuse_threshold: Mean thumbnail difference (0-255) for reuse (0 = off)
+            stats: Dict whose 'frames' and 'reused' counts are updated as frames are yielded
+            profiler: Optional StageProfiler that receives the extension and cache lookup times
+        
+        Yields:
+            Extended BGR frames in input order
+        """
+        # Frames without their own extension wait here until the next generated
+        # frame is ready. Every generated frame in the extender's look-ahead holds
+        # up to a whole gap of frames, so the look-ahead is shrunk by the gap below
+        decisions = deque()
+        gap = self.MAX_REUSED_FRAMES if reuse_threshold > 0 else sample_rate
+        
+        def generated_feed():
+            reference = None
+            reused_run = 0
+            for frame_idx, frame in frames:
+                if frame_idx % sample_rate:
+                    # Between two samples: takes the nearest generated extension
+                    decisions.append((frame_idx, frame, 'nearest'))
+                    reused_run += 1
+                    continue
+                
+                reuse = False
+                if reuse_threshold > 0:
+                    extension_height = int(frame.shape[0] * extension_ratio)
+                    thumbnail = edge_thumbnail(frame, position, extension_height)
+                    reuse = (
+                        reference is not None
+                        and reused_run < self.MAX_REUSED_FRAMES
+                        and thumbnail_difference(thumbnail, reference) <= reuse_threshold
+                    )
+                if reuse:
+                    # Edge unchanged since the last generated frame: keep its extension
+                    decisions.append((frame_idx, frame, 'previous'))
+                    reused_run += 1
+                else:
+                    decisions.append((frame_idx, frame, None))
+                    if reuse_threshold > 0:
+                        reference = thumbnail
+                    reused_run = 0
+                    yield frame_idx, frame
+        
+        def reused_frames(previous, previous_idx, following=None, following_idx=None):
+            while decisions and decisions[0][2] is not None:
+                frame_idx, frame, source = decisions.popleft()
+                extended = previous
+                if (source == 'nearest' and following is not None
+                        and following_idx - frame_idx < frame_idx - previous_idx):
+                    extended = following
+                
+                start = profiler.clock() if profiler else None
+                height = frame.shape[0]
+                if position == "bottom":
+                    extension = extended[height:]
+                else:
+                    extension = extended[:extended.shape[0] - height]
+                composed = self.ai_extender._compose(frame, extension, position)
+                if profiler:
+                    profiler.since('extend', start)
+                stats['frames'] += 1
+                stats['reused'] += 1
+                yield composed
+        
+        previous = None
+        previous_idx = None
+        queue_depth = max((self.queue_depth or self.workers * 2) // gap, 1)
+        for extended in self._extend_frames(generated_feed(), frame_count, position, extension_ratio,
+                                            queue_depth=queue_depth, batch_size=1 if gap > 1 else None,
+                                            profiler=profiler):
+            # Frames between the previous generated frame and this one
+            frame_idx = next(idx for idx, _, source in decisions if source is None)
+            if previous is not None:
+                yield from reused_frames(previous, previous_idx, extended, frame_idx)
+            decisions.popleft()
+            stats['frames'] += 1
+            yield extended
+            previous, previous_idx = extended, frame_idx
+        if previous is not None:
+            yield from reused_frames(previous, previous_idx)
+    
+    def _frames_to_video(self, frames, output_path, fps, dimensions, job=None, encoder_options=None,
+                         profiler=None):
+        """
+        Encode a stream of frames to a video
+        
+        Frames are piped straight into a single libx264 encode when ffmpeg is
+        available, otherwise written with OpenCV's mp4v encoder.
+        
+        Args:
+            frames: Iterable of BGR uint8 frames, consumed one at a time
+            output_path: Where to write the video
+            fps: Frames per second of the output
+            dimensions: (width, height) of every frame
+            job: Optional ProcessingJob to report written frames to and check for cancellation
+            encoder_options: Per-job overrides of the encoder settings (preset, crf, threads)
+            profiler: Optional StageProfiler that receives the time spent handing
+                frames to the encoder (encode) and waiting for it to finish (finalize)
+        """
+        video_writer = open_video_writer(
+            output_path, fps, dimensions, {**self.encoder_options, **(encoder_options or {})}
+        )
         
-        # Try to convert to H.264 for better compatibility if ffmpeg is available
         try:
-            temp_output = output_path + ".temp.mp4"
-            # Add quotes around the file paths to handle spaces properly
-            os.system(f'ffmpeg -i \"{output_path}\" -c:v libx264 -preset fast -crf 22 \"{temp_output}\"')
-            os.replace(temp_output, output_path)
-            print(f"Converted video to H.264 format")
-        except Exception as e:
-            print(f"Failed to convert to H.264: {e}")
+            for frames_done, frame in enumerate(frames, 1):
+                # Write to video
+                start = profiler.clock() if profiler else None
+                video_writer.write(frame)
+                if profiler:
+                    profiler.since('encode', start)
+                
+                if job:
+                    job.update(frames_done=frames_done)
+                    job.check_cancelled()
+        except BaseException:
+            # Don't leave a truncated video behind
+            video_writer.abort()
+            if os.path.exists(output_path):
+                os.remove(output_path)
+            raise
+        start = profiler.clock() if profiler else None
+        video_writer.release()
+        if profiler:
+            profiler.since('finalize', start, 0)
+        print(f"Video saved to {output_path}")
     
-    def process_video_keyframes(self, video_path, position="bottom", extension_ratio=1.0, keyframe_interval=24):
+    def process_video_keyframes(self, video_path, position="bottom", extension_ratio=1.0, keyframe_interval=24,
+                                job=None, encoder_options=None, interpolation="linear", adaptive=False,
+                                capture=None, output_path=None):
         """
         Process a video by only extending keyframes and interpolating between them
         
@@ -130,13 +638,25 @@ class VideoProcessor:
             video_path: Path to the input video
             position: "top" or "bottom" - where to add the extension
             extension_ratio: How much to extend relative to original height
-            keyframe_interval: Process 1 frame every N frames as keyframes
+            keyframe_interval: Process 1 frame every N frames as keyframes (with
+                adaptive, the typical spacing: static shots stretch to twice this)
+            job: Optional ProcessingJob that receives progress and can cancel the run
+            encoder_options: Encoder settings for this job (preset, crf, threads)
+            interpolation: "linear" to cross-fade keyframe extensions, or "flow"
+                to warp them along the estimated motion first
+            adaptive: Place keyframes at scene cuts and wherever the edge content
+                drifts, instead of every keyframe_interval frames
+            capture: Already opened capture to read instead of video_path (see process_video)
+            output_path: Where to write the result (defaults to a name in the output directory)
         
         Returns:
             Path to the processed video
         """
+        if keyframe_interval < 1:
+            raise ValueError(f"Keyframe interval must be at least 1, got {keyframe_interval}")
+        
         # Get video properties
-        cap = cv2.VideoCapture(video_path)
+        cap = capture if capture is not None else cv2.VideoCapture(video_path)
         if not cap.isOpened():
             raise ValueError(f"Could not open video file: {video_path}")
         
@@ -150,125 +670,144 @@ class VideoProcessor:
         new_height = height + extension_height
         
         # Create output video name
-        input_filename = os.path.basename(video_path)
-        name, ext = os.path.splitext(input_filename)
-        output_filename = f"{name}_vertical{ext}"
-        output_path = os.path.join(self.output_path, output_filename)
-        
-        # Create video writer
-        fourcc = cv2.VideoWriter_fourcc(*'mp4v')
-        video_writer = cv2.VideoWriter(output_path, fourcc, fps, (width, new_height))
-        
-        # Process keyframes
-        keyframes = {}
-        frame_idx = 0
-        
-        # First pass: process keyframes
-        print(f"First pass: Processing keyframes...")
-        while True:
-            ret, frame = cap.read()
-            if not ret:
-                break
-            
-            # Only process keyframes
-            if frame_idx % keyframe_interval == 0:
-                print(f"Processing keyframe {frame_idx}/{frame_count}")
-                
-                # Convert OpenCV BGR to PIL RGB format
-                pil_frame = Image.fromarray(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB))
-                
-                # Extend the frame
-                extended_frame = self.ai_extender.extend_frame(
-                    pil_frame, position, extension_ratio
-                )
-                
-                # Convert back to OpenCV format
-                keyframes[frame_idx] = cv2.cvtColor(np.array(extended_frame), cv2.COLOR_RGB2BGR)
-            
-            frame_idx += 1
+        output_path = output_path or self._output_path_for(video_path)
+        profiler = job.profiler if job else None
         
-        # Reset video capture
-        cap.release()
-        cap = cv2.VideoCapture(video_path)
+        interpolator = KeyframeInterpolator(width, height, extension_height, position, interpolation)
         
-        # Second pass: interpolate between keyframes and write video
-        print(f"Second pass: Interpolating between keyframes...")
-        frame_idx = 0
-        prev_keyframe_idx = 0
-        next_keyframe_idx = keyframe_interval
+        # Every frame is decoded straight into the frame region of an output
+        # canvas; canvases go back to the pool once the encoder has taken them
+        free_canvases = []
+        decode_canvas = [None]
         
-        # If we're extending at the top, we need to adjust where we paste the original frame
-        y_offset = extension_height if position == "top" else 0
+        def next_canvas_region():
+            canvas = free_canvases.pop() if free_canvases else np.empty((new_height, width, 3), dtype=np.uint8)
+            decode_canvas[0] = canvas
+            return interpolator.frame_region(canvas)
         
-        while True:
-            ret, frame = cap.read()
-            if not ret:
-                break
-            
-            # If we're at a keyframe, use the extended frame
-            if frame_idx in keyframes:
-                video_writer.write(keyframes[frame_idx])
-                prev_keyframe_idx = frame_idx
-                next_keyframe_idx = frame_idx + keyframe_interval
-            else:
-                # Otherwise, we need to interpolate
-                if next_keyframe_idx in keyframes:
-                    next_frame = keyframes[next_keyframe_idx]
+        scheduler = None
+        if adaptive:
+            scheduler = KeyframeScheduler(
+                position, extension_height,
+                max_interval=keyframe_interval * 2, min_interval=max(keyframe_interval // 4, 1)
+            )
+        
+        # Decoded frames wait here until the keyframe after them has been extended,
+        # so at most a couple of keyframe intervals are held in memory
+        pending_frames = deque()
+        # (frame_idx, is_cut) of every keyframe handed to the extender, in order
+        keyframe_info = deque()
+        frames_decoded = [0]
+        
+        def keyframe_feed():
+            decoded = self._read_frames(cap, next_canvas_region, profiler=profiler)
+            for frame_idx, frame in self._probe_quality(decoded, position, extension_ratio, job):
+                frames_decoded[0] = frame_idx + 1
+                canvas = decode_canvas[0]
+                region = interpolator.frame_region(canvas)
+                if frame is not region:
+                    # The decoder allocated its own frame, so copy it into place
+                    region[:] = frame
+                pending_frames.append((frame_idx, canvas))
+                if scheduler is not None:
+                    is_keyframe, is_cut = scheduler.check(region)
                 else:
-                    # If we don't have the next keyframe, use the previous
-                    next_keyframe_idx = frame_count  # won't be reached
-                    next_frame = keyframes[prev_keyframe_idx]
-                
-                prev_frame = keyframes[prev_keyframe_idx]
+                    is_keyframe, is_cut = frame_idx % keyframe_interval == 0, False
+                if is_keyframe:
+                    keyframe_info.append((frame_idx, is_cut))
+                    yield frame_idx, region
+        
+        # Single pass: keyframes are extended as they are decoded (with at most one
+        # keyframe of look-ahead in parallel mode) and the frames between two
+        # keyframes are written as soon as the later one is ready
+        if scheduler is not None:
+            print(f"Processing adaptive keyframes, at least every {scheduler.max_interval} frames...")
+        else:
+            print(f"Processing keyframes every {keyframe_interval} frames...")
+        if job:
+            job.update(frames_total=frame_count)
+        extended_keyframes = self._extend_frames(
+            keyframe_feed(), frame_count, position, extension_ratio, queue_depth=2, batch_size=1,
+            profiler=profiler
+        )
+        output_frames = self._interpolate_keyframes(
+            extended_keyframes, pending_frames, keyframe_info, interpolator, free_canvases, profiler
+        )
+        
+        self._frames_to_video(
+            output_frames, output_path, fps, (width, new_height), job, encoder_options, profiler
+        )
+        
+        # A streamed upload's length is only known once it has been decoded
+        frame_count = frames_decoded[0]
+        if job:
+            job.update(frames_total=frame_count)
+        keyframes = scheduler.keyframes if scheduler is not None else -(-frame_count // keyframe_interval)
+        print(f"Extended {keyframes} keyframes for {frame_count} frames")
+        if job:
+            job.update(keyframes=keyframes, scene_cuts=scheduler.cuts if scheduler is not None else 0)
+        
+        return output_path
+    
+    def _interpolate_keyframes(self, extended_keyframes, pending_frames, keyframe_info, interpolator,
+                               free_canvases, profiler=None):
+        """
+        Merge extended keyframes with the decoded frames between them
+        
+        Each yielded frame is only valid until the next one is requested: its
+        canvas is then handed back to free_canvases for the decoder to reuse.
+        
+        Args:
+            extended_keyframes: Extended keyframes in order
+            pending_frames: Deque of (frame_idx, canvas) pairs, filled by the decoder
+                as the keyframes are pulled; each canvas already holds its frame
+            keyframe_info: Deque of (frame_idx, is_cut) for each keyframe, filled as
+                the keyframes are pulled; frames before a cut hold the previous
+                keyframe instead of blending across it
+            interpolator: KeyframeInterpolator that writes the extensions in place
+            free_canvases: List that consumed canvases are returned to
+            profiler: Optional StageProfiler that receives the interpolation time
+        
+        Yields:
+            Output frames in order
+        """
+        prev_keyframe_idx = 0
+        prev_frame = None
+        
+        for next_frame in extended_keyframes:
+            next_keyframe_idx, is_cut = keyframe_info.popleft()
+            if prev_frame is not None:
+                # Flow mode estimates the motion between the keyframes here
+                start = profiler.clock() if profiler else None
+                interpolator.set_keyframes(prev_frame, prev_frame if is_cut else next_frame)
+                if profiler:
+                    profiler.since('interpolate', start, 0)
+            
+            # Every frame up to the new keyframe can now be interpolated
+            while pending_frames[0][0] < next_keyframe_idx:
+                frame_idx, canvas = pending_frames.popleft()
                 
                 # Calculate interpolation factor
-                if next_keyframe_idx > prev_keyframe_idx:
-                    blend_factor = (frame_idx - prev_keyframe_idx) / (next_keyframe_idx - prev_keyframe_idx)
-                else:
-                    blend_factor = 0
-                
-                # Create a blank frame
-                extended_frame = np.zeros((new_height, width, 3), dtype=np.uint8)
-                
-                # Only interpolate the extension area
-                if position == "top":
-                    # Interpolate the top part
-                    extension_prev = prev_frame[:extension_height, :]
-                    extension_next = next_frame[:extension_height, :]
-                    extension = cv2.addWeighted(extension_prev, 1 - blend_factor, extension_next, blend_factor, 0)
-                    
-                    # Place the extension at the top
-                    extended_frame[:extension_height, :] = extension
-                    
-                    # Place the original frame at the bottom
-                    extended_frame[extension_height:, :] = frame
-                else:  # bottom
-                    # Interpolate the bottom part
-                    extension_prev = prev_frame[height:, :]
-                    extension_next = next_frame[height:, :]
-                    extension = cv2.addWeighted(extension_prev, 1 - blend_factor, extension_next, blend_factor, 0)
-                    
-                    # Place the original frame at the top
-                    extended_frame[:height, :] = frame
-                    
-                    # Place the extension at the bottom
-                    extended_frame[height:, :] = extension
-                
-                # Write the interpolated frame
-                video_writer.write(extended_frame)
+                blend_factor = (frame_idx - prev_keyframe_idx) / (next_keyframe_idx - prev_keyframe_idx)
+                start = profiler.clock() if profiler else None
+                interpolator.render(canvas, blend_factor)
+                if profiler:
+                    profiler.since('interpolate', start)
+                yield canvas
+                free_canvases.append(canvas)
             
-            frame_idx += 1
-        
-        cap.release()
-        video_writer.release()
+            # If we're at a keyframe, use the extended frame
+            _, canvas = pending_frames.popleft()
+            free_canvases.append(canvas)
+            yield next_frame
+            
+            prev_keyframe_idx = next_keyframe_idx
+            prev_frame = next_frame
         
-        # Try to convert to H.264 for better compatibility if ffmpeg is available
-        try:
-            temp_output = output_path + ".temp.mp4"
-            os.system(f'ffmpeg -i \"{output_path}\" -c:v libx264 -preset fast -crf 22 \"{temp_output}\"')
-            os.replace(temp_output, output_path)
-            print(f"Converted video to H.264 format")
-        except Exception as e:
-            print(f"Failed to convert to H.264: {e}")
-        
-        return output_path
\ No newline at end of file
+        # Frames after the last keyframe have no next keyframe, so hold the previous one
+        if pending_frames:
+            interpolator.set_keyframes(prev_frame, prev_frame)
+        while pending_frames:
+            _, canvas = pending_frames.popleft()
+            yield interpolator.render(canvas, 0)
+            free_canvases.append(canvas)